@@ -1,2 +1,31 @@
+"""kaitor as a blueprint of a bigger app.
+
+The app that mounts bp calls init_app in place of db.init_app: it gets the storage profile
+of engines.py, the query counting of instrumentation.py and the schema migrated to the
+latest version. app_factory.create_app does the same for a standalone kaitor.
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///site.db"
+    kaitor.init_app(app, scheduler=True)
+    app.register_blueprint(kaitor.bp)
+"""
+from . import engines, instrumentation
 from .blueprints import bp
-from .models import db
\ No newline at end of file
+from .deadlines import DeadlineScheduler
+from .models import db, migrate
+
+
+def init_app(app, pool=None, pragmas=None, scheduler=False):
+    # scheduler=True opens comparisons in a background thread as deadlines pass; without it,
+    # run scheduler.py from cron
+    db_uri = app.config.setdefault("SQLALCHEMY_DATABASE_URI", "sqlite:///:memory:")
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engines.engine_options(db_uri, pool))
+    db.init_app(app)
+    instrumentation.init_app(app)
+    with app.app_context():
+        engines.set_pragmas(db.engine, pragmas)
+        db.create_all()
+        migrate()
+
+    if scheduler:
+        app.extensions["kaitor_scheduler"] = DeadlineScheduler(app)
+        app.extensions["kaitor_scheduler"].start()
@@ -1,7 +1,7 @@
-from app_factory import create_app
+from .app_factory import create_app
 
 app = create_app(db_uri="sqlite:///site.db")
 
-from models import *
+from .models import *
 
 app.app_context().__enter__()
\ No newline at end of file
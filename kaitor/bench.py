@@ -0,0 +1,193 @@
+"""Load benchmark: a synthetic cohort driven through the real routes from many threads.
+
+    python -m kaitor.bench --users 2000 --threads 16 --output bench.json
+    python -m kaitor.bench --baseline bench.json
+
+Prints p50/p95/p99 latency and queries per request for each route, and saves them as JSON
+so that two commits can be compared with --baseline.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from .app_factory import create_app
+from .models import *
+
+WORDS = "somma prodotto quindi poiché allora ogni esiste numero primo pari dispari resto".split()
+
+
+def _words(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def build_cohort(groups, users, problems, solve_rate, compare_rate, seed):
+    # Half of the problems are past due with reviews open, the other half still open
+    rng = random.Random(seed)
+    now = datetime.now()
+    group_names = [f"Classe {i + 1}" for i in range(groups)]
+    for name in group_names:
+        add_group(name)
+    for i in range(users):
+        user = add_user(f"Studente {i + 1:05d}")
+        set_membership(user, group_names[i % groups])
+
+    shorts = [f"Problema {j + 1}" for j in range(problems)]
+    for j, short in enumerate(shorts):
+        add_problem(short, f"# {short}\n\nDimostra che $n^2 + n$ è pari per ogni $n = {j}k$.")
+    past, future = shorts[:max(1, problems // 2)], shorts[max(1, problems // 2):]
+    set_due_solution(group_names, past, now - timedelta(days=1))
+    if future:
+        set_due_solution(group_names, future, now + timedelta(days=7))
+
+    user_names = [f"Studente {i + 1:05d}" for i in range(users)]
+    for short in shorts:
+        rate = solve_rate if short in past else solve_rate / 2
+        for name in user_names:
+            if rng.random() < rate:
+                add_solution(name, short, _words(rng, 60))
+
+    for short in past:
+        for name in group_names:
+            set_due_comparison(name, short, date=now + timedelta(days=7), seed=seed)
+        problem = read_problem(short)
+        for due in S.query(DueComparison).filter_by(problem_id=problem.id).all():
+            if rng.random() < compare_rate:
+                left, right = due.pair
+                add_comparison(due.user_id, problem.id, left, right, _words(rng, 20))
+
+    tokens = [token for token, in S.query(User.token).order_by(User.id)]
+    past_ids = [read_problem(short).id for short in past]
+    future_ids = [read_problem(short).id for short in future]
+    reviewers = [
+        (token, problem_id)
+        for token, problem_id in S.query(User.token, DueComparison.problem_id)
+        .join(DueComparison, DueComparison.user_id == User.id)
+    ]
+    group_ids = [read_group(name).id for name in group_names]
+    return dict(tokens=tokens, past=past_ids, future=future_ids, reviewers=reviewers, groups=group_ids)
+
+
+def plan_requests(cohort, requests, assignments, seed):
+    # (route, method, url, keyword arguments of the test client call)
+    rng = random.Random(seed)
+    problems = cohort["past"] + cohort["future"]
+    deadline = (datetime.now() + timedelta(days=7)).strftime("%d-%m-%Y")
+    plan = []
+    for _ in range(requests):
+        token = rng.choice(cohort["tokens"])
+        plan.append(("dashboard", "GET", f"/kaitor/u/{token}/", {}))
+        plan.append(("problem", "GET", f"/kaitor/u/{token}/p/{rng.choice(problems)}/", {}))
+        if cohort["future"]:
+            plan.append(("submit", "POST", f"/kaitor/u/{token}/p/{rng.choice(cohort['future'])}/submit/", dict(
+                json={"solution_text": _words(rng, 60)},
+            )))
+        if cohort["reviewers"]:
+            token, problem_id = rng.choice(cohort["reviewers"])
+            plan.append(("compare", "POST", f"/kaitor/u/{token}/p/{problem_id}/compare/", dict(
+                json={"left_is_better": (left := rng.random() < 0.5), "right_is_better": not left,
+                      "motivation": _words(rng, 20)},
+            )))
+    for _ in range(assignments):
+        plan.append(("assignment", "POST", "/kaitor/88EB109E/set_due_comparisons/", dict(data={
+            "group": rng.choice(cohort["groups"]),
+            "problem": rng.choice(cohort["past"]),
+            "action": "add",
+            "date": deadline,
+        })))
+    rng.shuffle(plan)
+    return plan
+
+
+def run(app, plan, threads):
+    def call(item):
+        route, method, url, kwargs = item
+        start = time.perf_counter()
+        response = app.test_client().open(url, method=method, **kwargs)
+        elapsed = time.perf_counter() - start
+        queries = int(response.headers.get("X-Query-Count", 0))
+        return route, elapsed, queries, response.status_code < 500
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(call, plan))
+    wall = time.perf_counter() - start
+
+    report = {}
+    for route in sorted({route for route, *_ in results}):
+        latencies = np.array([elapsed for r, elapsed, _, _ in results if r == route]) * 1000
+        queries = np.array([n for r, _, n, _ in results if r == route])
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        report[route] = dict(
+            requests=len(latencies),
+            errors=sum(not ok for r, _, _, ok in results if r == route),
+            p50_ms=round(p50, 2),
+            p95_ms=round(p95, 2),
+            p99_ms=round(p99, 2),
+            queries=round(float(queries.mean()), 2),
+        )
+    return report, dict(requests=len(results), seconds=round(wall, 2), per_second=round(len(results) / wall, 1))
+
+
+def print_report(report, total, baseline=None):
+    print(f"{'route':<12}{'requests':>9}{'errors':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}")
+    for route, row in report.items():
+        line = (
+            f"{route:<12}{row['requests']:>9}{row['errors']:>7}"
+            f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}{row['queries']:>9.2f}"
+        )
+        old = (baseline or {}).get("routes", {}).get(route)
+        if old:
+            line += f"   p95 x{row['p95_ms'] / old['p95_ms']:.2f}, queries {row['queries'] - old['queries']:+.2f}"
+        print(line)
+    print(f"{total['requests']} requests in {total['seconds']}s, {total['per_second']} per second")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="database URI, a fresh SQLite file by default")
+    parser.add_argument("--groups", type=int, default=8)
+    parser.add_argument("--users", type=int, default=800)
+    parser.add_argument("--problems", type=int, default=4)
+    parser.add_argument("--solve-rate", type=float, default=0.8)
+    parser.add_argument("--compare-rate", type=float, default=0.5)
+    parser.add_argument("--requests", type=int, default=200, help="requests per user route")
+    parser.add_argument("--assignments", type=int, default=10, help="admin assignment requests")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench.json", help="where to save the results")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    args = parser.parse_args()
+
+    db_uri = args.db or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    app = create_app(db_uri)
+
+    start = time.perf_counter()
+    with app.app_context():
+        cohort = build_cohort(
+            args.groups, args.users, args.problems, args.solve_rate, args.compare_rate, args.seed,
+        )
+    print(f"Cohort of {args.users} users built in {time.perf_counter() - start:.1f}s")
+
+    plan = plan_requests(cohort, args.requests, args.assignments, args.seed)
+    report, total = run(app, plan, args.threads)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, total, baseline)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "db")}
+    with open(args.output, "w") as f:
+        json.dump(dict(config=config, total=total, routes=report), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,37 @@
-from flask import Blueprint, render_template, request, redirect, url_for
+from flask import (Blueprint, Response, jsonify, render_template, request, redirect,
+                   stream_with_context, url_for)
 from datetime import date as datetime_date
+from .. import models
 from ..models import *
+from ..export import export_grades
+from ..search import search
+from ..similarity import browse_duplicate_clusters
 
 bp = Blueprint('admin', __name__, url_prefix="/88EB109E/")
 
+def paginate(browse, model, arg="after"):
+    # One keyset page of browse, plus what the pager needs to link to the next one
+    after = request.args.get(arg, type=int)
+    items = browse(after=after, limit=PAGE_SIZE + 1)
+    next = items[PAGE_SIZE - 1].id if len(items) > PAGE_SIZE else None
+    # The links keep every other query argument, filters and other pagers included
+    args = {**request.view_args, **request.args.to_dict()}
+    args.pop(arg, None)
+    return dict(
+        items=items[:PAGE_SIZE], total=count_rows(model),
+        first_url=url_for(request.endpoint, **args),
+        next_url=url_for(request.endpoint, **args, **{arg: next}) if next else None,
+    )
+
 @bp.route('/')
 def main():
+    # The pickers list everything: a paginated select hides whatever is past the first page
     groups = browse_groups()
     problems = browse_problems()
     return render_template('admin/main.html', groups=groups, problems=problems)
 
 @bp.route('/set_due_solutions/', methods=['POST'])
+@unit_of_work()
 def set_due_solutions():
     group_id = request.form['group']
     problem_id = request.form['problem']
@@ -26,6 +47,7 @@ def set_due_solutions():
     return redirect(next)
 
 @bp.route('/set_due_comparisons/', methods=['POST'])
+@unit_of_work()
 def set_due_comparisons():
     group_id = request.form['group']
     problem_id = request.form['problem']
@@ -39,12 +61,47 @@ def set_due_comparisons():
 
     return redirect(next)
 
+@bp.route('/progress/')
+def progress():
+    group_id = request.args.get('group', type=int)
+    return render_template(
+        'admin/progress.html',
+        progress=read_progress(group_id),
+        group=read_group(group_id) if group_id else None,
+        groups=browse_groups(),
+        states=PROGRESS_STATES,
+    )
+
+@bp.route('/grades.csv')
+def export_grades_csv():
+    # Streamed: the first line leaves before the rows are read
+    group_id = request.args.get('group', type=int)
+    name = f"grades-{group_id}.csv" if group_id else "grades.csv"
+    return Response(
+        stream_with_context(export_grades(group_id)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{name}"'},
+    )
+
+@bp.route('/search/')
+def search_index():
+    query = request.args.get('q', '')
+    kind = request.args.get('kind') or None
+    page = request.args.get('page', 0, type=int)
+    results = search(query, kind=kind, offset=page * PAGE_SIZE, limit=PAGE_SIZE + 1)
+    return jsonify({
+        "results": results[:PAGE_SIZE],
+        "page": page,
+        "next": page + 1 if len(results) > PAGE_SIZE else None,
+    })
+
 @bp.route('/groups/')
 def groups_index():
-    groups = browse_groups()
-    return render_template('admin/groups/index.html', groups=groups)
+    page = paginate(browse_groups, Group)
+    return render_template('admin/groups/index.html', groups=page["items"], page=page)
 
 @bp.route('/groups/new/', methods=['GET', 'POST'])  
+@unit_of_work()
 def new_group():
     if request.method == 'POST':
         name = request.form['name']
@@ -59,6 +116,7 @@ def view_group(id):
     return render_template('admin/groups/read.html', group=group)
 
 @bp.route('/groups/<int:id>/edit/', methods=['GET', 'POST'])
+@unit_of_work()
 def update_group(id):
     group = read_group(id)
     
@@ -77,8 +135,9 @@ def update_group(id):
     return render_template('admin/groups/edit.html', group=group)
 
 @bp.route('/groups/<int:id>/delete/', methods=['POST'])  
+@unit_of_work()
 def delete_group(id):
-    delete_group(id)
+    models.delete_group(id)
     return redirect(url_for('kaitor.admin.groups_index'))
 
 
@@ -92,16 +151,18 @@ def view_user(id):
 ## Problems
 @bp.route('/problems/')
 def problems_index():
-    problems = browse_problems()
-    return render_template('admin/problems/index.html', problems=problems)
+    page = paginate(browse_problems, Problem)
+    return render_template('admin/problems/index.html', problems=page["items"], page=page)
 
 @bp.route('/problems/<id>')
 def view_problem(id):
     problem = read_problem(id)
-    return render_template('admin/problems/read.html', problem=problem)
+    clusters = browse_duplicate_clusters(problem)
+    return render_template('admin/problems/read.html', problem=problem, clusters=clusters)
 
 
 @bp.route('/problems/new', methods=["GET", "POST"])
+@unit_of_work()
 def new_problem():
     if request.method == 'POST':
         short = request.form['short']
@@ -112,26 +173,23 @@ def new_problem():
     return render_template('admin/problems/new.html')
 
 @bp.route('/problems/<int:id>/edit/', methods=['GET', 'POST'])
+@unit_of_work()
 def update_problem(id):
     problem = read_problem(id)
     
     if request.method == 'POST':
-        name = request.form['name']
-        new_user_name = request.form["new_user_name"]
-        new_user = read_user(new_user_name)
-        if new_user_name and not new_user:
-            new_user = add_user(new_user_name)
-        if new_user:
-            edit_group(id, name, extra_users=[new_user])
-        else:
-            edit_group(id, name)
-        return redirect(url_for('kaitor.admin.update_group', id=id))
+        try:
+            edit_problem(id, request.form['short'], request.form['text'])
+        except ValueError as e:
+            return render_template('admin/problems/edit.html', problem=problem, error=str(e)), 400
+        return redirect(url_for('kaitor.admin.view_problem', id=id))
 
     return render_template('admin/problems/edit.html', problem=problem)
 
 
 
 @bp.route('/problems/<int:id>/delete/', methods=['POST'])  
+@unit_of_work()
 def delete_problem(id):
-    delete_problem(id)
+    models.delete_problem(id)
     return redirect(url_for('kaitor.admin.problems_index'))
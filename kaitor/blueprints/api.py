@@ -0,0 +1,102 @@
+from datetime import datetime
+import zlib
+
+from flask import Blueprint, jsonify, request
+
+from ..models import *
+from .conditional import etag
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1/")
+
+# Fields sent when the request does not ask for ?fields=a,b,c
+PROBLEM_LIST_FIELDS = ["id", "short", "date", "state", "comparison_state"]
+MEMBER_FIELDS = ["id", "name"]
+LEADERBOARD_FIELDS = ["id", "name", *STANDING_COLUMNS]
+
+
+def requested_fields(available, default):
+    fields = request.args.get("fields")
+    if not fields:
+        return default, None
+    fields = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in available]
+    if unknown:
+        return None, (jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400)
+    return fields, None
+
+
+def serialize(fields, row):
+    return {
+        name: value.isoformat() if isinstance(value, datetime) else value
+        for name, value in zip(fields, row)
+    }
+
+
+def page_version(token, problem_id=None):
+    # Same versions as the HTML pages, per field selection
+    user = read_user_by_token(token)
+    if user is None:
+        return None
+    version = read_page_version(user, problem_id or 0)
+    return f"{version}.{zlib.crc32(request.query_string)}"
+
+
+@bp.route("/u/<token>/problems/")
+@etag(page_version)
+def problems(token):
+    user = read_user_by_token(token)
+    if user is None:
+        return jsonify({"error": "Invalid credentials"}), 401
+    fields, error = requested_fields(due_problem_fields(user.id, datetime.now()), PROBLEM_LIST_FIELDS)
+    if error:
+        return error
+    rows = browse_due_problems(user, fields)
+    return jsonify({"problems": [serialize(fields, row) for row in rows]})
+
+
+@bp.route("/u/<token>/problems/<int:problem_id>/")
+@etag(page_version)
+def problem(token, problem_id):
+    user = read_user_by_token(token)
+    if user is None:
+        return jsonify({"error": "Invalid credentials"}), 401
+    available = due_problem_fields(user.id, datetime.now())
+    fields, error = requested_fields(available, list(available))
+    if error:
+        return error
+    rows = browse_due_problems(user, fields, problem=problem_id)
+    if not rows:
+        return jsonify({"error": "Problem not found"}), 404
+    return jsonify({"problem": serialize(fields, rows[0])})
+
+
+@bp.route("/g/<group_id>/members/")
+def members(group_id):
+    group = S.get(Group, group_id)
+    if group is None:
+        return jsonify({"error": "Group not found"}), 404
+    fields, error = requested_fields(member_fields(), MEMBER_FIELDS)
+    if error:
+        return error
+    rows = browse_roster(group, fields, after=request.args.get("after"), limit=PAGE_SIZE + 1)
+    return jsonify({
+        "members": [serialize(fields, row) for row in rows[:PAGE_SIZE]],
+        "next": rows[PAGE_SIZE - 1][-1] if len(rows) > PAGE_SIZE else None,
+    })
+
+
+@bp.route("/g/<group_id>/leaderboard/")
+def leaderboard(group_id):
+    group = S.get(Group, group_id)
+    if group is None:
+        return jsonify({"error": "Group not found"}), 404
+    fields, error = requested_fields(standing_fields(), LEADERBOARD_FIELDS)
+    if error:
+        return error
+    problem_id = request.args.get("problem", type=int)
+    rows = browse_leaderboard(group, problem_id, fields)
+    return jsonify({
+        "group": group.id,
+        "problem": problem_id,
+        "standings": [serialize(fields, row) for row in rows],
+    })
@@ -0,0 +1,23 @@
+import functools
+
+from flask import make_response, request
+
+
+def etag(read_tag):
+    # Answer If-None-Match with 304 before the view runs: read_tag gets the view arguments
+    # and returns the current tag of the page, or None to always run the view.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            tag = read_tag(**kwargs)
+            if tag is None:
+                return view(**kwargs)
+            if request.if_none_match.contains(tag):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(**kwargs))
+            response.set_etag(tag)
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return wrapper
+    return decorator
@@ -10,7 +10,41 @@ bp = Blueprint('group', __name__, url_prefix='/g/<group_id>/')
 @bp.route("/")
 def select_users(group_id):
     g = S.get(Group, group_id)
-    return render_template("select_user.html", group=g, users=g.users)
+    members = cached_fragment("members", g.id, lambda: render_template(
+        "fragments/members.html", users=search_members(g, limit=PAGE_SIZE), total=count_members(g),
+    ))
+    return render_template("select_user.html", group=g, members=members)
+
+@bp.route("/leaderboard/")
+def leaderboard(group_id):
+    g = S.get(Group, group_id)
+    if g is None:
+        return redirect(url_for("kaitor.main"))
+    problem_id = request.args.get("problem", type=int)
+    return render_template(
+        "leaderboard.html",
+        group=g,
+        problem_id=problem_id,
+        problems=browse_leaderboard_problems(g),
+        standings=browse_leaderboard(g, problem_id),
+    )
+
+@bp.route("/users/")
+def search_users(group_id):
+    g = S.get(Group, group_id)
+    if g is None:
+        return jsonify({"error": "Group not found"}), 404
+    users = search_members(
+        g,
+        prefix=request.args.get("q", ""),
+        after=request.args.get("after"),
+        limit=PAGE_SIZE + 1,
+    )
+    return jsonify({
+        "users": [u.name for u in users[:PAGE_SIZE]],
+        "next": users[PAGE_SIZE - 1].name if len(users) > PAGE_SIZE else None,
+        "total": count_members(g),
+    })
 
 # Middleware to check user credentials in each request
 def authenticate_user(username, password):
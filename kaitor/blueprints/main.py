@@ -4,21 +4,25 @@ from flask import (Blueprint, flash, g, jsonify, redirect, render_template,
                    request, session, url_for)
 
 from ..models import *
+from ..rendering import render_markdown
 
 bp = Blueprint('kaitor', __name__, url_prefix='/kaitor/', template_folder="../templates/", static_folder="../static/")
 S = db.session 
 
-from . import admin, group, user
+from . import admin, api, group, user
 
 bp.register_blueprint(admin.bp)
+bp.register_blueprint(api.bp)
 bp.register_blueprint(group.bp)
 bp.register_blueprint(user.bp)
+bp.add_app_template_filter(render_markdown, "markdown")
 
 
 @bp.route("/", methods=["GET"])
 def main():
-    groups = S.query(Group).all()
-
+    groups = cached_fragment("groups", None, lambda: render_template(
+        "fragments/groups.html", groups=S.query(Group).order_by(Group.id).all(),
+    ))
     return render_template("select_group.html", groups=groups)
 
 @bp.route("/help")
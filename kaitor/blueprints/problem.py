@@ -4,13 +4,23 @@ from datetime import datetime
 from flask import Blueprint, jsonify, redirect, render_template, request, url_for
 
 from ..models import *
+from ..rendering import forget_rendered
+from ..search import unindex
+from ..similarity import unsign_solution
+from .conditional import etag
 
 bp = Blueprint("problem", __name__, url_prefix="/p/<problem_id>/")
 
 
+def page_version(token, problem_id):
+    user = read_user_by_token(token)
+    return read_page_version(user, problem_id) if user and problem_id.isdigit() else None
+
+
 @bp.route("/", methods=["GET"])
+@etag(page_version)
 def main(token, problem_id):
-    user = S.query(User).filter_by(token=token).first()
+    user = read_user_by_token(token)
     problem = S.get(Problem, problem_id)
     due_solution = (
         S.query(DueSolution)
@@ -39,7 +49,7 @@ def main(token, problem_id):
         S.query(Comparison).filter_by(user_id=user.id, problem_id=problem.id).first()
     )
     if comparison_open:
-        left_id, right_id = due_comparison.others.split(";")
+        left_id, right_id = due_comparison.pair
         comparison_open = dict(
             left_id=int(left_id),
             right_id=int(right_id),
@@ -56,13 +66,16 @@ def main(token, problem_id):
             right_better=(comparison.better == int(right_id)) if comparison else False,
         )
 
-    positive_inbound_comparisons = S.query(Comparison).filter_by(problem_id=problem.id, better=user.id).all()
-    negative_inbound_comparisons = S.query(Comparison).filter_by(problem_id=problem.id, worse=user.id).all()
+    positive_inbound_comparisons, negative_inbound_comparisons = browse_inbound_comparisons(user, problem)
 
+    problem_header = cached_fragment("problem", problem.id, lambda: render_template(
+        "fragments/problem_header.html", problem=problem,
+    ))
     return render_template(
         "user_solve.html",
         user=user,
         problem=problem,
+        problem_header=problem_header,
         solution=solution,
         solution_open=solution_open,
         comparison=comparison,
@@ -75,7 +88,7 @@ def main(token, problem_id):
 @bp.route("/submit/", methods=["POST"])
 def submit(token, problem_id):
     data = request.get_json()
-    user = S.query(User).filter_by(token=token).first()
+    user = read_user_by_token(token)
     problem = S.get(Problem, problem_id)
     solution_text = data.get("solution_text")
 
@@ -98,27 +111,31 @@ def submit(token, problem_id):
         S.query(Solution).filter_by(user_id=user.id, problem_id=problem.id).first()
     )
 
+    if solution:
+        forget_rendered(solution.solution_text)
+
     if solution and not solution_text:
+        unindex(solution_id=solution.id)
+        unsign_solution(solution.id)
         S.delete(solution)
+        bump_versions([user.id], [problem.id])
+        refresh_standings([user.id], [problem.id])
+        S.commit()
+        forget_progress()
 
     elif not solution and not solution_text:
         return jsonify({"error": "Solution should contains something"}), 400
 
-    elif solution_text and solution is None:
-        solution = Solution(
-            user_id=user.id, problem_id=problem.id, solution_text=solution_text
-        )
-        S.add(solution)
     else:
-        solution.solution_text = solution_text
-    S.commit()
+        # One upsert, so that two submissions racing each other cannot collide
+        add_solution(user, problem, solution_text, replace=True)
 
     return jsonify({"message": "Solution updated"})
 
 
 @bp.route("/compare/", methods=["POST"])
 def compare(token, problem_id):
-    user = S.query(User).filter_by(token=token).first()
+    user = read_user_by_token(token)
     problem = S.get(Problem, problem_id)
     data = request.get_json()
     left_is_better = bool(data.get("left_is_better", False))
@@ -133,7 +150,7 @@ def compare(token, problem_id):
         S.query(DueComparison).filter_by(user_id=user.id, problem_id=problem.id).first()
     )
     comparison_open = due_comparison and due_comparison.date > datetime.now()
-    left_id, right_id = due_comparison.others.split(";")
+    left_id, right_id = due_comparison.pair
     if not comparison_open:
         return (
             jsonify(
@@ -148,24 +165,7 @@ def compare(token, problem_id):
             400,
         )
 
-    comparison = (
-        S.query(Comparison).filter_by(user_id=user.id, problem_id=problem.id).first()
-    )
     better = left_id if left_is_better else right_id
     worse = right_id if left_is_better else left_id
-    if not comparison:
-        comparison = Comparison(
-            user_id=user.id,
-            problem_id=problem.id,
-            better=better,
-            worse=worse,
-            motivation=motivation,
-        )
-        S.add(comparison)
-    else:
-        comparison.better = better
-        comparison.worse = worse
-        comparison.motivation = motivation
-    S.commit()
-    print(S.query(Comparison).all())
+    add_comparison(user, problem, better, worse, motivation)
     return jsonify({"message": "Comparison updated"})
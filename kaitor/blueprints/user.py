@@ -6,6 +6,7 @@ from flask import (
 )
 
 from ..models import *
+from .conditional import etag
 
 bp = Blueprint('user', __name__, url_prefix='/u/<token>/')
 from . import problem
@@ -18,12 +19,15 @@ def set_password(token):
     username = data.get("username")
     new_password = data.get("new_password")
 
-    user = S.query(User).filter_by(name=username, token=token).first()
+    user = read_user_by_token(token)
     # user = S.query(User).filter_by(name=username, token=token, password=None).first()
 
-    if user:
+    if user and user.name == username:
         user.password = new_password
+        # The dashboard warns about missing passwords, so its ETag must change with it
+        bump_versions([user.id])
         S.commit()
+        forget_token(token)
         return jsonify({"message": "Password set successfully"})
     else:
         return (
@@ -35,55 +39,15 @@ def set_password(token):
             400,
         )
 
+def page_version(token):
+    user = read_user_by_token(token)
+    return read_page_version(user) if user else None
+
 @bp.route("/", methods=["GET"])
+@etag(page_version)
 def main(token):
-    user = S.query(User).filter_by(token=token).first()
-
-
-    past_problems = [
-        vars(read_problem(ds.problem_id)) | {
-            "due_comparison": S.query(DueComparison).filter(
-            DueComparison.user_id == user.id,
-            DueComparison.problem_id == ds.problem_id,
-            DueComparison.date > datetime.now()
-        ).first(),
-            "comparison": S.query(Comparison).filter(
-            Comparison.user_id == user.id,
-            Comparison.problem_id == ds.problem_id).first()
-        }
-        for ds in S.query(DueSolution).filter(
-            DueSolution.user_id == user.id,
-            DueSolution.date < datetime.now()
-        )
-    ]
-
-    solved_problems = [
-        read_problem(ds.problem_id)
-        for ds in S.query(DueSolution).filter(
-            DueSolution.user_id == user.id,
-            DueSolution.date > datetime.now()
-        )
-        if (
-            S.query(Solution)
-            .filter_by(user_id=user.id, problem_id=ds.problem_id)
-            .first()
-        )
-    ]
-
-    unsolved_problems = [
-        vars(read_problem(ds.problem_id)) | {"date": ds.date}
-        for ds in S.query(DueSolution).filter(
-            DueSolution.user_id == user.id,
-            DueSolution.date > datetime.now()
-        )
-        if not (
-            S.query(Solution)
-            .filter_by(user_id=user.id, problem_id=ds.problem_id)
-            .first()
-        )
-    ]
-    
-    print("COMPARISON", S.query(Comparison).all())
+    user = read_user_by_token(token)
+    past_problems, solved_problems, unsolved_problems = read_dashboard(user)
 
     return render_template(
         "user_main.html",
@@ -0,0 +1,93 @@
+"""Deadlines and the jobs that run as they pass.
+
+The index on DueSolution.date is the schedule: each run reads only the deadlines passed
+since the previous one, and opens comparisons for the (group, problem) pairs they belong to.
+refresh_points refits the points of every user, at most every REFIT_INTERVAL. The scheduler
+command runs both once; DeadlineScheduler keeps running them in a background thread.
+"""
+from datetime import datetime, timedelta
+from logging import warn
+import threading
+
+from .models import (DueSolution, S, Watermark, _insert, _set_due_comparison, db, memberships,
+                     refit_points, unit_of_work)
+
+
+REVIEW_DAYS = 7
+SCHEDULER_INTERVAL = 300
+REFIT_INTERVAL = timedelta(hours=1)
+deadlines_changed = threading.Event()
+
+def _read_watermark(name):
+    return S.scalar(db.select(Watermark.date).where(Watermark.name == name))
+
+def _write_watermark(name, date):
+    stmt = _insert(Watermark).values(name=name, date=date)
+    S.execute(stmt.on_conflict_do_update(index_elements=["name"], set_={"date": stmt.excluded.date}))
+
+def browse_passed_deadlines(since, now):
+    return S.execute(
+        db.select(memberships.c.group_id, DueSolution.problem_id)
+        .join(memberships, memberships.c.user_id == DueSolution.user_id)
+        .where(DueSolution.date >= since, DueSolution.date < now)
+        .distinct()
+        .order_by(memberships.c.group_id, DueSolution.problem_id)
+    ).all()
+
+def read_next_deadline(now=None):
+    return S.scalar(db.select(db.func.min(DueSolution.date)).where(DueSolution.date > (now or datetime.now())))
+
+def open_due_comparisons(now=None):
+    # The first run looks back as far as set_due_comparison(problem=None) does
+    now = now or datetime.now()
+    since = _read_watermark("deadlines") or now - timedelta(days=14)
+    pairs = browse_passed_deadlines(since, now)
+    with unit_of_work():
+        for group_id, problem_id in pairs:
+            _set_due_comparison(group_id, problem_id, now + timedelta(days=REVIEW_DAYS), True, False, None, now=now)
+        _write_watermark("deadlines", now)
+    return pairs
+
+
+class DeadlineScheduler(threading.Thread):
+    # Runs open_due_comparisons in the background, waking up at the next deadline, after
+    # set_due_solution changes the schedule, or every interval seconds at the latest.
+    def __init__(self, app, interval=SCHEDULER_INTERVAL):
+        super().__init__(name="kaitor-deadlines", daemon=True)
+        self.app = app
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            with self.app.app_context():
+                try:
+                    open_due_comparisons()
+                    refresh_points()
+                    next_deadline = read_next_deadline()
+                except Exception as e:
+                    S.rollback()
+                    warn(f"Deadline scheduler failed: {e}")
+                    next_deadline = None
+            timeout = self.interval
+            if next_deadline is not None:
+                timeout = min(timeout, max(0, (next_deadline - datetime.now()).total_seconds()) + 1)
+            deadlines_changed.wait(timeout)
+            deadlines_changed.clear()
+
+    def stop(self):
+        self.stopped.set()
+        deadlines_changed.set()
+
+
+def refresh_points(now=None):
+    # refit_points at most every REFIT_INTERVAL, for the scheduler: in between, apply_verdict
+    # moves the points of each verdict by an Elo step. True when it refitted.
+    now = now or datetime.now()
+    last = _read_watermark("points")
+    if last is not None and last > now - REFIT_INTERVAL:
+        return False
+    with unit_of_work():
+        refit_points()
+        _write_watermark("points", now)
+    return True
@@ -0,0 +1,50 @@
+"""Storage profile of the database engine.
+
+Every database gets a sized connection pool with pre-ping. SQLite files also get pragmas on
+each new connection: WAL lets readers go on while a writer holds the lock, busy_timeout
+makes writers wait for each other instead of failing with "database is locked".
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+POOL = {
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_timeout": 30,
+    "pool_recycle": 1800,
+}
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -64000,
+    "mmap_size": 268435456,
+}
+
+
+def _is_sqlite_memory(url):
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def engine_options(db_uri, pool=None):
+    # For SQLALCHEMY_ENGINE_OPTIONS: in-memory SQLite keeps its single static connection
+    options = {"pool_pre_ping": True}
+    if not _is_sqlite_memory(make_url(db_uri)):
+        options.update(POOL if pool is None else pool)
+    return options
+
+
+def set_pragmas(engine, pragmas=None):
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+    if _is_sqlite_memory(engine.url):
+        pragmas = {k: v for k, v in pragmas.items() if k not in ("journal_mode", "mmap_size")}
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
@@ -0,0 +1,91 @@
+"""End of term grades.
+
+End of term grades: a CSV row per student, with the state, the verdicts received and the
+points of each problem. The rows come from a single query read in yield_per batches and
+leave as soon as each student is complete. The per-problem points are fitted upfront,
+from the comparisons of the exported problems alone, and those stay in memory.
+"""
+import csv
+from datetime import datetime
+import io
+from itertools import groupby
+
+from .models import (Comparison, DueComparison, DueSolution, Problem, S, Solution, User, _progress_state,
+                     db, fit_problem_points, memberships)
+
+
+EXPORT_BATCH_SIZE = 1000
+GRADE_COLUMNS = ["state", "wins", "losses", "points"]
+
+def browse_grades(group_id=None, now=None):
+    # Header, then a row per student (members of group_id, or everyone with a problem due)
+    now = now or datetime.now()
+    if group_id is not None:
+        users = db.select(memberships.c.user_id).where(memberships.c.group_id == group_id)
+    else:
+        users = db.select(DueSolution.user_id).distinct()
+    problems = list(S.execute(
+        db.select(Problem.id, Problem.short)
+        .where(Problem.id.in_(db.select(DueSolution.problem_id).where(DueSolution.user_id.in_(users))))
+        .order_by(Problem.id)
+    ))
+    yield ["id", "name", "points", *(f"{p.short} {column}" for p in problems for column in GRADE_COLUMNS)]
+
+    points = fit_problem_points([p.id for p in problems])
+    column = {p.id: 3 + len(GRADE_COLUMNS) * i for i, p in enumerate(problems)}
+
+    def exists(model):
+        return db.exists().where(
+            model.user_id == DueSolution.user_id, model.problem_id == DueSolution.problem_id,
+        )
+
+    def count(side):
+        return (
+            db.select(db.func.count())
+            .where(Comparison.problem_id == DueSolution.problem_id, side == DueSolution.user_id)
+            .scalar_subquery()
+        )
+
+    # In primary key order of DueSolution, so that the database streams without sorting
+    stmt = (
+        db.select(
+            DueSolution.user_id,
+            User.name,
+            User.points,
+            DueSolution.problem_id,
+            DueSolution.date <= now,
+            exists(Solution),
+            exists(DueComparison),
+            exists(Comparison),
+            count(Comparison.better),
+            count(Comparison.worse),
+        )
+        .join(User, User.id == DueSolution.user_id)
+        .where(DueSolution.user_id.in_(users))
+        .order_by(DueSolution.user_id, DueSolution.problem_id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    rows = S.execute(stmt)
+    for user_id, cells in groupby(rows, key=lambda row: row[0]):
+        row = None
+        for _, name, user_points, problem_id, *flags, wins, losses in cells:
+            if row is None:
+                row = [user_id, name, user_points or 0] + [""] * (len(column) * len(GRADE_COLUMNS))
+            i = column[problem_id]
+            row[i:i + len(GRADE_COLUMNS)] = [
+                _progress_state(*flags) or "open",
+                wins,
+                losses,
+                points.get(problem_id, {}).get(user_id, ""),
+            ]
+        yield row
+
+def export_grades(group_id=None, now=None):
+    # browse_grades as CSV text, one chunk per line
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in browse_grades(group_id, now):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
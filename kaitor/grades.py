@@ -0,0 +1,39 @@
+"""Export the end of term grades as CSV.
+
+One row per student, with the state, the verdicts received and the points of each problem:
+
+    python -m kaitor.grades --db sqlite:///site.db --group "3A" > grades.csv
+"""
+import argparse
+import sys
+
+from .app_factory import create_app
+from .export import export_grades
+from .models import read_group
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="sqlite:///site.db", help="database URI")
+    parser.add_argument("--group", help="name or id of a group, every student by default")
+    parser.add_argument("--output", help="CSV file to write, the standard output by default")
+    args = parser.parse_args(argv)
+
+    app = create_app(db_uri=args.db)
+    with app.app_context():
+        group_id = None
+        if args.group is not None:
+            group = read_group(args.group)
+            if group is None:
+                parser.error(f"no group {args.group}")
+            group_id = group.id
+        out = open(args.output, "w", newline="") if args.output else sys.stdout
+        try:
+            out.writelines(export_grades(group_id))
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Count the SQL statements and the database time of each request.
+
+init_app adds X-Query-Count and Server-Timing headers to every response and logs the same
+numbers at debug level. query_budget makes a test fail when a block runs too many queries:
+
+    with query_budget(3):
+        client.get("/")
+
+    @query_budget(3)
+    def test_dashboard(...): ...
+"""
+from contextlib import ContextDecorator
+import logging
+import threading
+import time
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+_local = threading.local()
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+
+
+def _active():
+    # Every counter open on this thread: the request one and any query_budget inside it
+    if not hasattr(_local, "active"):
+        _local.active = []
+    return _local.active
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    for stats in _active():
+        stats.count += 1
+        stats.seconds += elapsed
+        stats.statements.append(statement)
+
+
+def _listen():
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def init_app(app):
+    _listen()
+
+    @app.before_request
+    def start_counting():
+        g.query_stats = QueryStats()
+        _active().append(g.query_stats)
+
+    @app.after_request
+    def report_queries(response):
+        stats = g.get("query_stats")
+        if stats is not None:
+            response.headers["X-Query-Count"] = str(stats.count)
+            response.headers["Server-Timing"] = f"db;dur={stats.seconds * 1000:.2f}"
+            log.debug(
+                "%s %s: %d queries in %.2f ms",
+                request.method, request.path, stats.count, stats.seconds * 1000,
+            )
+        return response
+
+    @app.teardown_request
+    def stop_counting(exc):
+        stats = g.pop("query_stats", None)
+        if stats in _active():
+            _active().remove(stats)
+
+
+class query_budget(ContextDecorator):
+    # Fails with an AssertionError listing the statements when more than limit queries run
+    def __init__(self, limit):
+        self.limit = limit
+
+    def __enter__(self):
+        _listen()
+        self.stats = QueryStats()
+        _active().append(self.stats)
+        return self.stats
+
+    def __exit__(self, exc_type, exc, tb):
+        _active().remove(self.stats)
+        if exc_type is None and self.stats.count > self.limit:
+            statements = "\n".join(self.stats.statements)
+            raise AssertionError(
+                f"{self.stats.count} queries, over the budget of {self.limit}:\n{statements}"
+            )
+        return False
@@ -1,4 +1,4 @@
-from app_factory import create_app
+from .app_factory import create_app
 
 app = create_app(db_uri="sqlite:///site.db")
 
@@ -1,11 +1,21 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import chain
 from logging import warn
 import random
+import threading
+import time
 from typing import List
+from markupsafe import Markup
+import numpy as np
 import uuid
+from sqlalchemy import Select
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Mapped, mapped_column
 from datetime import datetime, timedelta
 
 from database import db
+from .rendering import forget_rendered
 # class Base(DeclarativeBase):
 #     pass
 
@@ -42,7 +52,7 @@ class User(db.Model):
     name = db.Column(db.String(80), unique=True, nullable=False)
     password = db.Column(db.String(50))  # Allow nullable passwords
     points = db.Column(db.Integer, default=0)
-    token = db.Column(db.String(16), nullable=False)
+    token = db.Column(db.String(16), nullable=False, unique=True, index=True)
     problems: Mapped[List["Problem"]] = db.relationship(
         secondary="due_solution",
         # lazy="subquery",
@@ -55,7 +65,7 @@ class User(db.Model):
 
 class Problem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    short = db.Column(db.String(80))
+    short = db.Column(db.String(80), unique=True, index=True)
     text = db.Column(db.Text(), nullable=False)
 
     def __repr__(self):
@@ -65,14 +75,47 @@ class Problem(db.Model):
 class DueSolution(db.Model):
     user_id: Mapped[int] = mapped_column(db.ForeignKey("user.id"), primary_key=True)
     problem_id = db.Column(db.Integer, db.ForeignKey("problem.id"), primary_key=True)
-    date = db.Column(db.DateTime, nullable=False)
+    date = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        db.Index("ix_due_solution_user_date", "user_id", "date"),
+    )
 
 
 class DueComparison(db.Model):
     user_id: Mapped[int] = mapped_column(db.ForeignKey("user.id"), primary_key=True)
     problem_id: Mapped[int] = mapped_column(db.ForeignKey("problem.id"), primary_key=True)
     date = db.Column(db.DateTime, nullable=False)
-    others = db.Column(db.String(20))
+    targets: Mapped[List["DueComparisonTarget"]] = db.relationship(
+        order_by="DueComparisonTarget.position",
+        cascade="all, delete-orphan",
+        lazy="selectin",
+    )
+
+    __table_args__ = (
+        db.Index("ix_due_comparison_user_problem_date", "user_id", "problem_id", "date"),
+    )
+
+    @property
+    def pair(self):
+        return tuple(t.reviewed_id for t in self.targets)
+
+
+class DueComparisonTarget(db.Model):
+    # The solutions a reviewer has to compare: position 0 is shown on the left, 1 on the right
+    user_id: Mapped[int] = mapped_column(primary_key=True)
+    problem_id: Mapped[int] = mapped_column(primary_key=True)
+    position: Mapped[int] = mapped_column(primary_key=True)
+    reviewed_id: Mapped[int] = mapped_column(db.ForeignKey("user.id"), nullable=False)
+
+    __table_args__ = (
+        db.ForeignKeyConstraint(
+            ["user_id", "problem_id"],
+            ["due_comparison.user_id", "due_comparison.problem_id"],
+            ondelete="CASCADE",
+        ),
+        db.Index("ix_due_comparison_target_reviewed", "reviewed_id", "problem_id", "user_id"),
+    )
 
 
 # class DueProblem(db.Model):
@@ -95,6 +138,10 @@ class Solution(db.Model):
     user = db.relationship("User", backref=db.backref("solutions", lazy=True))
     problem = db.relationship("Problem", backref=db.backref("solutions", lazy=True))
 
+    __table_args__ = (
+        db.Index("ix_solution_user_problem", "user_id", "problem_id", unique=True),
+    )
+
 
 # class CompareRequest(db.Model):
 #     id = db.Column(db.Integer, primary_key=True)
@@ -119,21 +166,150 @@ class Comparison(db.Model):
     
     motivation = db.Column(db.Text, nullable=False)
 
-    @property
-    def better_solution(self):
-        return S.query(Solution).filter_by(problem_id=self.problem_id, user_id=self.better).first()
-    
-    @property
-    def worse_solution(self):
-        return S.query(Solution).filter_by(problem_id=self.problem_id, user_id=self.worse).first()
+    better_solution: Mapped["Solution"] = db.relationship(
+        primaryjoin="and_(Solution.problem_id == foreign(Comparison.problem_id), "
+        "Solution.user_id == foreign(Comparison.better))",
+        viewonly=True,
+    )
+    worse_solution: Mapped["Solution"] = db.relationship(
+        primaryjoin="and_(Solution.problem_id == foreign(Comparison.problem_id), "
+        "Solution.user_id == foreign(Comparison.worse))",
+        viewonly=True,
+    )
+
+    __table_args__ = (
+        db.Index("ix_comparison_user_problem", "user_id", "problem_id", unique=True),
+        db.Index("ix_comparison_problem_better", "problem_id", "better"),
+        db.Index("ix_comparison_problem_worse", "problem_id", "worse"),
+    )
+
+
+class SolutionSignature(db.Model):
+    # MinHash signature of a solution text, see minhash
+    solution_id: Mapped[int] = mapped_column(db.ForeignKey("solution.id"), primary_key=True)
+    problem_id: Mapped[int] = mapped_column(db.ForeignKey("problem.id"), index=True)
+    signature = db.Column(db.LargeBinary, nullable=False)
+
+
+class SolutionBand(db.Model):
+    # Locality-sensitive hashing buckets: solutions sharing a bucket are duplicate candidates
+    problem_id: Mapped[int] = mapped_column(primary_key=True)
+    band: Mapped[int] = mapped_column(primary_key=True)
+    bucket = db.Column(db.BigInteger, primary_key=True)
+    solution_id: Mapped[int] = mapped_column(db.ForeignKey("solution.id"), primary_key=True, index=True)
+
+
+class Watermark(db.Model):
+    # Last time a periodic job ran, see deadlines.open_due_comparisons
+    name: Mapped[str] = mapped_column(db.String(80), primary_key=True)
+    date = db.Column(db.DateTime, nullable=False)
+
+
+class PageVersion(db.Model):
+    # Bumped whenever what user_id sees of problem_id changes, see read_page_version.
+    # problem_id 0 stands for the dashboard, (0, 0) for changes that concern everyone.
+    user_id: Mapped[int] = mapped_column(primary_key=True)
+    problem_id: Mapped[int] = mapped_column(primary_key=True)
+    version: Mapped[int] = mapped_column(nullable=False, default=0)
+
+
+class Standing(db.Model):
+    # Leaderboard row of user_id in group_id for problem_id, kept up to date by the helpers,
+    # see refresh_standings. problem_id 0 holds the totals over the problems of the group.
+    group_id: Mapped[int] = mapped_column(primary_key=True)
+    problem_id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    submissions: Mapped[int] = mapped_column(nullable=False, default=0)
+    wins: Mapped[int] = mapped_column(nullable=False, default=0)
+    losses: Mapped[int] = mapped_column(nullable=False, default=0)
+    reviews_done: Mapped[int] = mapped_column(nullable=False, default=0)
+    reviews_pending: Mapped[int] = mapped_column(nullable=False, default=0)
+
+
+class SchemaVersion(db.Model):
+    # Migrations applied to this database, see migrate
+    version: Mapped[int] = mapped_column(primary_key=True)
+    date = db.Column(db.DateTime, nullable=False)
 
 
 ### BREAD utilities
 
+# Unit of work: the helpers commit through _commit, which only flushes inside unit_of_work.
+# The outermost unit_of_work commits once at the end, or rolls everything back on error.
+_unit = threading.local()
+
+def in_unit_of_work():
+    return getattr(_unit, "depth", 0) > 0
+
+def _commit():
+    if in_unit_of_work():
+        S.flush()
+    else:
+        S.commit()
+
+@contextmanager
+def unit_of_work():
+    depth = getattr(_unit, "depth", 0)
+    _unit.depth = depth + 1
+    try:
+        yield S
+        if depth == 0:
+            S.commit()
+    except BaseException:
+        if depth == 0:
+            S.rollback()
+        raise
+    finally:
+        _unit.depth = depth
+    if depth == 0:
+        # The helpers dropped their cached entries before the commit, when other requests
+        # could still cache the old rows: drop everything again now that it is visible
+        forget_counts()
+        forget_progress()
+        forget_token()
+        forget_fragments()
+        deadlines_changed.set()
+
+
+# Keyset pagination: browse_* return the rows with key greater than after, at most limit of them
+PAGE_SIZE = 50
+
+def _browse(query, key, after=None, limit=None):
+    if after is not None:
+        query = query.filter(key > after)
+    query = query.order_by(key)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+# Row counts for the paginated listings, kept for COUNT_TTL seconds or until a helper writes
+COUNT_TTL = 60
+_counts = {}
+
+def _count(key, stmt):
+    count, expires = _counts.get(key, (None, 0))
+    if expires < time.monotonic():
+        count = S.scalar(stmt)
+        _counts[key] = (count, time.monotonic() + COUNT_TTL)
+    return count
+
+def count_rows(model):
+    return _count(model.__tablename__, db.select(db.func.count()).select_from(model))
+
+def count_members(group):
+    group = read_group(group)
+    return _count(
+        ("memberships", group.id),
+        db.select(db.func.count()).where(memberships.c.group_id == group.id),
+    )
+
+def forget_counts():
+    _counts.clear()
+
 
 ## Group
-def browse_groups():
-    return S.query(Group).all()
+def browse_groups(after=None, limit=None):
+    return _browse(S.query(Group), Group.id, after, limit)
 
 
 def read_group(arg):
@@ -143,23 +319,35 @@ def read_group(arg):
     return g
 
 
+def search_members(group, prefix="", after=None, limit=None):
+    # Members of group whose name starts with prefix, in name order (keyset on name)
+    group = read_group(group)
+    query = S.query(User).join(memberships).filter(memberships.c.group_id == group.id)
+    if prefix:
+        query = query.filter(User.name.startswith(prefix, autoescape=True))
+    return _browse(query, User.name, after, limit)
+
+
 def edit_group(id, name, extra_users=[]):
     g = S.get(Group, id)
 
     g.name = name
     g.users = list(set(g.users) | set(extra_users))
-    S.commit()
+    refresh_standings([u.id for u in extra_users])
+    _commit()
+    forget_counts()
+    forget_progress()
+    forget_fragments("groups")
+    forget_fragments("members", g.id)
 
 
 def add_group(name):
-    g = S.query(Group).filter(Group.name == name).first()
-    if g is None:
-        g = Group(name=name)
-        S.add(g)
-        S.commit()
-    else:
-        warn(f"Group {name} already exists.")
-    return g
+    rows, many = _batch(name)
+    groups = _upsert(Group, [dict(name=name) for name, in rows], ["name"])
+    _commit()
+    forget_counts()
+    forget_fragments("groups")
+    return groups if many else groups[0]
 
 
 def delete_group(id=None, *, name=None):
@@ -174,12 +362,17 @@ def delete_group(id=None, *, name=None):
         warn(f"Such group (id={id}, name={name}) does not exist.")
     else:
         S.delete(g)
-        S.commit()
+        S.execute(db.delete(Standing).where(Standing.group_id == g.id))
+        _commit()
+        forget_counts()
+        forget_progress()
+        forget_fragments("groups")
+        forget_fragments("members", g.id)
 
 
 ## User
-def browse_users():
-    return S.query(User).all()
+def browse_users(after=None, limit=None):
+    return _browse(S.query(User), User.id, after, limit)
 
 
 def read_user(arg):
@@ -194,18 +387,23 @@ def edit_user(id, name, password=...):
     u.name = name
     if password is not ...:
         u.password = password
-    S.commit()
+    bump_versions([0])
+    _commit()
+    forget_token(u.token)
+    forget_fragments("members")
 
 
 def add_user(name, password=None):
-    u = S.query(User).filter(User.name == name).first()
-    if u is None:
-        u = User(name=name, password=password, token=uuid.uuid4().hex.upper()[:16])
-        S.add(u)
-        S.commit()
-    else:
-        warn(f"User {name} already exists.")
-    return u
+    # Existing users are returned as they are: the password only applies to new ones
+    rows, many = _batch(name, password)
+    users = _upsert(User, [
+        dict(name=name, password=password, token=uuid.uuid4().hex.upper()[:16])
+        for name, password in rows
+    ], ["name"])
+    _commit()
+    forget_counts()
+    forget_fragments("members")
+    return users if many else users[0]
 
 
 def delete_user(id=None, name=None):
@@ -220,11 +418,50 @@ def delete_user(id=None, name=None):
         warn(f"No such user with id={id} or name={name}")
     else:
         S.delete(u)
-        S.commit()
+        S.execute(db.delete(Standing).where(Standing.user_id == u.id))
+        bump_versions([0])
+        _commit()
+        forget_token(u.token)
+        forget_counts()
+        forget_progress()
+        forget_fragments("members")
+
+
+# Bounded LRU token -> user id, so that authenticated pages skip the token lookup. Other
+# workers may have deleted the user, and SQLite reuses ids: the row must still hold the token.
+TOKEN_CACHE_SIZE = 4096
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+def read_user_by_token(token):
+    with _token_cache_lock:
+        user_id = _token_cache.get(token)
+        if user_id is not None:
+            _token_cache.move_to_end(token)
+    if user_id is not None:
+        u = S.get(User, user_id)
+        if u is not None and u.token == token:
+            return u
+        forget_token(token)
+
+    u = S.query(User).filter_by(token=token).first()
+    if u is not None:
+        with _token_cache_lock:
+            _token_cache[token] = u.id
+            if len(_token_cache) > TOKEN_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+    return u
+
+def forget_token(token=None):
+    with _token_cache_lock:
+        if token is None:
+            _token_cache.clear()
+        else:
+            _token_cache.pop(token, None)
 
 ## Problem
-def browse_problems():
-    return S.query(Problem).all()
+def browse_problems(after=None, limit=None):
+    return _browse(S.query(Problem), Problem.id, after, limit)
 
 def read_problem(arg):
     if isinstance(arg, Problem): 
@@ -233,20 +470,27 @@ def read_problem(arg):
     return p
 
 def edit_problem(id, short, text):
+    # ValueError, before any change, when another problem already has short
     p = S.get(Problem, id)
+    if S.scalar(db.select(Problem.id).where(Problem.short == short, Problem.id != p.id)) is not None:
+        raise ValueError(f"Another problem is already called {short}")
+    forget_rendered(p.text)
     p.short = short 
     p.text = text
-    S.commit()
+    index_problem(p)
+    bump_versions([0])
+    _commit()
+    forget_fragments("problem", p.id)
     
 def add_problem(short, text):
-    p = S.query(Problem).filter(Problem.short == short).first()
-    if p is None:
-        p = Problem(short=short, text=text)
-        S.add(p)
-        S.commit()
-    else:
-        warn(f"Problem {short} already exists")
-    return p
+    # Existing problems are returned as they are, text included
+    rows, many = _batch(short, text)
+    problems = _upsert(Problem, [dict(short=short, text=text) for short, text in rows], ["short"])
+    for p in problems:
+        index_problem(p)
+    _commit()
+    forget_counts()
+    return problems if many else problems[0]
         
 def delete_problem(id=None, short=None):
     if id:
@@ -260,11 +504,20 @@ def delete_problem(id=None, short=None):
         warn(f"No such problem with id={id} or short={short}")
     else:
         S.delete(p)
-        S.commit()
+        unindex(problem_id=p.id)
+        S.execute(db.delete(SolutionBand).where(SolutionBand.problem_id == p.id))
+        S.execute(db.delete(SolutionSignature).where(SolutionSignature.problem_id == p.id))
+        S.execute(db.delete(Standing).where(Standing.problem_id == p.id))
+        _sum_standings()
+        bump_versions([0])
+        _commit()
+        forget_counts()
+        forget_progress()
+        forget_fragments("problem", p.id)
 
 ## Solution
-def browse_solutions():
-    return S.query(Solution).all()
+def browse_solutions(after=None, limit=None):
+    return _browse(S.query(Solution), Solution.id, after, limit)
 
 def read_solution(arg=None):
     raise NotImplementedError
@@ -283,21 +536,37 @@ def edit_solution(id, user_id, problem_id, solution_text):
     s.user_id = user_id 
     s.problem_id = problem_id
     s.solution_text = solution_text
-    S.commit()
+    _commit()
     
-def add_solution(user, problem, solution_text):
-    user = read_user(user)
-    problem = read_problem(problem)
-
-    s = S.query(Solution).filter_by(user_id=user.id, problem_id=problem.id).first()
-
-    if not s:
-        s = Solution(user_id=user.id, problem_id=problem.id, solution_text=solution_text)
-        S.add(s)
+def add_solution(user, problem, solution_text, replace=False):
+    # IndexError if a solution already exists, unless replace is set
+    rows, many = _batch(user, problem, solution_text)
+    values = [
+        dict(user_id=read_user(user).id, problem_id=read_problem(problem).id, solution_text=text)
+        for user, problem, text in rows
+    ]
+    if replace:
+        solutions = _upsert(Solution, values, ["user_id", "problem_id"], update=["solution_text"])
     else:
-        raise IndexError
-    S.commit()
-    return s
+        stmt = _insert(Solution).on_conflict_do_nothing(index_elements=["user_id", "problem_id"])
+        inserted = {
+            (s.user_id, s.problem_id): s for s in S.scalars(stmt.returning(Solution), values)
+        }
+        if len(inserted) < len(values):
+            if not in_unit_of_work():
+                S.rollback()
+            raise IndexError
+        solutions = [inserted[v["user_id"], v["problem_id"]] for v in values]
+    for s in solutions:
+        index_solution(s)
+        sign_solution(s)
+        bump_versions([s.user_id], [s.problem_id])
+    for problem_id in {s.problem_id for s in solutions}:
+        refresh_standings([s.user_id for s in solutions if s.problem_id == problem_id], [problem_id])
+    _commit()
+    forget_counts()
+    forget_progress()
+    return solutions if many else solutions[0]
         
 def delete_solution(id):
     raise NotImplementedError
@@ -306,7 +575,7 @@ def delete_solution(id):
         warn(f"No solution with id {id}")
     else:
         S.delete(s)
-        S.commit()
+        _commit()
 
 ## Comparisons
         ## Comparison
@@ -324,44 +593,380 @@ def edit_comparison(id, user_id, problem_id, better_id, worse_id, motivation):
     c.better_id = better_id
     c.worse_id = worse_id
     c.motivation = motivation
-    S.commit()
+    _commit()
 
 def add_comparison(user, problem, better, worse, motivation):
-    user = read_user(user)
-    problem = read_problem(problem)
-    better = read_user(better)
-    worse = read_user(worse)
-
-    assert all(x is not None for x in [user, problem, better, worse])
-    assert motivation
-    
-    c = S.query(Comparison).filter_by(user_id=user.id, problem_id=problem.id).first()
-
-    if c:
-        c.better = better
-        c.worse = worse
-        c.motivation = motivation
-    else:
-        c = Comparison(
-            user_id=user.id,
-            problem_id=problem.id,
-            better=better.id,
-            worse=worse.id,
-            motivation=motivation
+    # Replaces the previous verdict of user on problem, if any
+    rows, many = _batch(user, problem, better, worse, motivation)
+    values = []
+    for user, problem, better, worse, motivation in rows:
+        user, problem, better, worse = read_user(user), read_problem(problem), read_user(better), read_user(worse)
+        assert all(x is not None for x in [user, problem, better, worse])
+        assert motivation
+        values.append(dict(
+            user_id=user.id, problem_id=problem.id, better=better.id, worse=worse.id, motivation=motivation,
+        ))
+
+    # The points of the users involved are updated incrementally: the previous verdicts are
+    # needed to undo them, all in one read
+    previous = {
+        (user_id, problem_id): (better, worse)
+        for user_id, problem_id, better, worse in S.execute(
+            db.select(Comparison.user_id, Comparison.problem_id, Comparison.better, Comparison.worse)
+            .where(db.tuple_(Comparison.user_id, Comparison.problem_id).in_(
+                [(v["user_id"], v["problem_id"]) for v in values]
+            ))
         )
-        S.add(c)
-    S.commit()
-    return c
+    }
+    for v in values:
+        before = previous.get((v["user_id"], v["problem_id"]))
+        apply_verdict(v["better"], v["worse"], previous=before)
+        bump_versions([v["user_id"], v["better"], v["worse"], *(before or ())], [v["problem_id"]])
+
+    comparisons = _upsert(
+        Comparison, values, ["user_id", "problem_id"], update=["better", "worse", "motivation"],
+    )
+    for problem_id in {v["problem_id"] for v in values}:
+        refresh_standings({
+            user_id
+            for v in values if v["problem_id"] == problem_id
+            for user_id in [v["user_id"], v["better"], v["worse"], *previous.get((v["user_id"], problem_id), ())]
+        }, [problem_id])
+    _commit()
+    forget_progress()
+    return comparisons if many else comparisons[0]
 
 def delete_comparison(id):
     raise NotImplementedError
     c = read_comparison(id)
     if c:
         S.delete(c)
-        S.commit()
+        _commit()
     else:
         warn(f"No comparison with id {id}")
 
+## Fragments
+# Rendered pieces of pages that only change on admin edits, kept for FRAGMENT_TTL seconds or
+# until the model helpers that change them call forget_fragments. The helpers only reach
+# the cache of their own process: the TTL bounds how stale the other workers can get.
+# Keys are (kind, id) tuples.
+FRAGMENT_CACHE_SIZE = 512
+FRAGMENT_TTL = 30
+_fragments = OrderedDict()
+_fragments_lock = threading.Lock()
+fragment_stats = {"hits": 0, "misses": 0}
+
+def cached_fragment(kind, id, render):
+    key = (kind, id)
+    with _fragments_lock:
+        html, expires = _fragments.get(key, (None, 0))
+        if expires >= time.monotonic():
+            _fragments.move_to_end(key)
+            fragment_stats["hits"] += 1
+            return html
+        fragment_stats["misses"] += 1
+    html = Markup(render())
+    with _fragments_lock:
+        _fragments[key] = (html, time.monotonic() + FRAGMENT_TTL)
+        _fragments.move_to_end(key)
+        if len(_fragments) > FRAGMENT_CACHE_SIZE:
+            _fragments.popitem(last=False)
+    return html
+
+def forget_fragments(kind=None, id=None):
+    # Everything, every fragment of a kind, or a single one
+    with _fragments_lock:
+        if kind is None:
+            _fragments.clear()
+        elif id is not None:
+            _fragments.pop((kind, id), None)
+        else:
+            for key in [key for key in _fragments if key[0] == kind]:
+                del _fragments[key]
+
+
+## Ranking
+# Strengths follow a Bradley-Terry model, P(i beats j) = p_i / (p_i + p_j), and are stored
+# in User.points on the Elo scale: points = ELO_SCALE * ln(p), so that 0 is the starting value.
+# apply_verdict moves them by an Elo step as verdicts arrive, and deadlines.refresh_points
+# refits them every hour, so that they stay on the scale of the per-problem points.
+ELO_SCALE = 400 / np.log(10)
+ELO_K = 32
+
+def fit_strengths(better, worse, n, iterations=500, tol=1e-5):
+    # Minorization-maximization (Hunter, 2004), vectorized over all comparisons. Every
+    # player also gets one virtual win and one virtual loss against a reference of strength
+    # 1, which keeps unbeaten and winless players finite and fixes the scale.
+    better = np.asarray(better, dtype=np.int64)
+    worse = np.asarray(worse, dtype=np.int64)
+    wins = np.bincount(better, minlength=n) + 1.0
+    p = np.ones(n)
+    for _ in range(iterations):
+        inv = 1.0 / (p[better] + p[worse])
+        games = np.bincount(better, inv, n) + np.bincount(worse, inv, n) + 2.0 / (p + 1.0)
+        new = wins / games
+        converged = np.max(np.abs(new - p) / p) < tol
+        p = new
+        if converged:
+            break
+    return p
+
+def _fit_points(better, worse):
+    users, index = np.unique(np.stack([better, worse], axis=1), return_inverse=True)
+    index = index.reshape(-1, 2)
+    p = fit_strengths(index[:, 0], index[:, 1], len(users))
+    return dict(zip(users.tolist(), np.rint(ELO_SCALE * np.log(p)).astype(int).tolist()))
+
+def _read_verdicts(stmt):
+    # (problem_id, better, worse) rows of stmt as an array
+    rows = S.execute(stmt).all()
+    return np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=3 * len(rows)).reshape(-1, 3)
+
+def _fit_per_problem(rows):
+    per_problem = {}
+    order = np.argsort(rows[:, 0], kind="stable")
+    problem_ids, starts = np.unique(rows[order, 0], return_index=True)
+    for problem_id, chunk in zip(problem_ids.tolist(), np.split(rows[order], starts[1:])):
+        per_problem[problem_id] = _fit_points(chunk[:, 1], chunk[:, 2])
+    return per_problem
+
+def fit_rankings():
+    # Overall and per-problem points of every user that took part in a comparison
+    rows = _read_verdicts(db.select(Comparison.problem_id, Comparison.better, Comparison.worse))
+    if len(rows) == 0:
+        return {}, {}
+    return _fit_points(rows[:, 1], rows[:, 2]), _fit_per_problem(rows)
+
+def fit_problem_points(problems):
+    # The per-problem points of fit_rankings for the given problem ids only: each problem
+    # is fitted on its own comparisons, so the others need not be read
+    rows = _read_verdicts(
+        db.select(Comparison.problem_id, Comparison.better, Comparison.worse)
+        .where(Comparison.problem_id.in_(problems))
+    )
+    return _fit_per_problem(rows)
+
+def refit_points():
+    overall, per_problem = fit_rankings()
+    S.execute(db.update(User).values(points=0))
+    if overall:
+        S.execute(db.update(User), [dict(id=id, points=points) for id, points in overall.items()])
+    bump_versions([0])
+    _commit()
+    return overall, per_problem
+
+def _elo_step(users, better, worse):
+    expected = 1 / (1 + 10 ** (((users[worse].points or 0) - (users[better].points or 0)) / 400))
+    delta = ELO_K * (1 - expected)
+    users[better].points = round((users[better].points or 0) + delta)
+    users[worse].points = round((users[worse].points or 0) - delta)
+
+def apply_verdict(better, worse, previous=None):
+    # Incremental update of the points of the users involved in a (possibly changed) verdict.
+    # The caller commits.
+    if previous == (better, worse):
+        return
+    ids = {better, worse} | set(previous or ())
+    users = {u.id: u for u in S.query(User).filter(User.id.in_(ids))}
+    if previous:
+        _elo_step(users, previous[1], previous[0])
+    _elo_step(users, better, worse)
+
+
+## Standings
+# The leaderboard is a table rather than a query: every helper that changes a solution,
+# a verdict or an assignment recomputes the rows of the users and problems it touched, so
+# that reading the leaderboard of a group is a range scan of its primary key.
+STANDING_COLUMNS = ["submissions", "wins", "losses", "reviews_done", "reviews_pending"]
+
+def refresh_standings(users=None, problems=None):
+    # users is a list of user ids or a select of them, problems a list of problem ids; None
+    # means all of them. Rows exist for the members of each group with the problem due.
+    # The caller commits.
+    S.flush()
+    member = memberships.c.user_id
+    problem_id = DueSolution.problem_id
+
+    def count(*where):
+        return db.select(db.func.count()).where(*where).scalar_subquery()
+
+    done = db.exists().where(
+        Comparison.user_id == DueComparison.user_id,
+        Comparison.problem_id == DueComparison.problem_id,
+    )
+    cells = (
+        db.select(
+            memberships.c.group_id,
+            member,
+            problem_id,
+            count(Solution.user_id == member, Solution.problem_id == problem_id),
+            count(Comparison.problem_id == problem_id, Comparison.better == member),
+            count(Comparison.problem_id == problem_id, Comparison.worse == member),
+            count(Comparison.user_id == member, Comparison.problem_id == problem_id),
+            count(DueComparison.user_id == member, DueComparison.problem_id == problem_id, ~done),
+        )
+        .join(DueSolution, DueSolution.user_id == member)
+    )
+    stale = db.delete(Standing).where(Standing.problem_id != 0)
+    if users is not None:
+        cells = cells.where(member.in_(users))
+        stale = stale.where(Standing.user_id.in_(users))
+    if problems is not None:
+        cells = cells.where(problem_id.in_(problems))
+        stale = stale.where(Standing.problem_id.in_(problems))
+    S.execute(stale)
+    S.execute(db.insert(Standing).from_select(
+        ["group_id", "user_id", "problem_id", *STANDING_COLUMNS], cells,
+    ))
+    _sum_standings(users)
+
+def _sum_standings(users=None):
+    # Rewrite the totals (problem_id 0) of users from their rows for each problem
+    columns = [getattr(Standing, name) for name in STANDING_COLUMNS]
+    totals = (
+        db.select(Standing.group_id, Standing.user_id, db.literal(0), *map(db.func.sum, columns))
+        .where(Standing.problem_id != 0)
+        .group_by(Standing.group_id, Standing.user_id)
+    )
+    stale = db.delete(Standing).where(Standing.problem_id == 0)
+    if users is not None:
+        totals = totals.where(Standing.user_id.in_(users))
+        stale = stale.where(Standing.user_id.in_(users))
+    S.execute(stale)
+    S.execute(db.insert(Standing).from_select(
+        ["group_id", "user_id", "problem_id", *STANDING_COLUMNS], totals,
+    ))
+
+def rebuild_standings():
+    # From scratch, e.g. after an import or a change made outside the helpers
+    refresh_standings()
+    _commit()
+    return count_rows(Standing)
+
+def standing_fields():
+    return {
+        "id": User.id,
+        "name": User.name,
+        **{name: getattr(Standing, name) for name in STANDING_COLUMNS},
+    }
+
+def browse_leaderboard(group, problem=None, fields=None):
+    # Rows of the members of group with their standing on problem, or overall, best first
+    group = read_group(group)
+    columns = standing_fields()
+    stmt = (
+        db.select(*(columns[name] for name in fields or columns))
+        .join(User, User.id == Standing.user_id)
+        .where(Standing.group_id == group.id, Standing.problem_id == (problem or 0))
+        .order_by(
+            Standing.wins.desc(), Standing.losses, Standing.submissions.desc(),
+            Standing.reviews_done.desc(), User.name,
+        )
+    )
+    return S.execute(stmt).all()
+
+def browse_leaderboard_problems(group):
+    # Problems that have a leaderboard in group
+    group = read_group(group)
+    return list(S.scalars(
+        db.select(Problem)
+        .where(Problem.id.in_(
+            db.select(Standing.problem_id).where(Standing.group_id == group.id, Standing.problem_id != 0)
+        ))
+        .order_by(Problem.id)
+    ))
+
+
+## Progress
+# Admin matrix of users by problems. Every cell comes out of one GROUP BY over the rows
+# the four tables have for the same (user, problem), and the matrix is kept for
+# PROGRESS_TTL seconds, or until a helper writes: late cells appear as deadlines pass.
+# A cell is late without a solution past the deadline, then submitted, pending once a
+# review is assigned and reviewed once it is done; empty while the deadline is ahead.
+PROGRESS_TTL = 30
+PROGRESS_STATES = ["submitted", "late", "pending", "reviewed"]
+_progress = {}
+
+def _progress_cells(users, now):
+    # {(user_id, problem_id): state} for the problems due to users, None while open
+    flags = ["solved", "assigned", "reviewed"]
+
+    def part(model, due=None, flag=None):
+        return db.select(
+            model.user_id,
+            model.problem_id,
+            (due if due is not None else db.null()).label("due"),
+            *(db.literal(int(name == flag)).label(name) for name in flags),
+        ).where(model.user_id.in_(users))
+
+    rows = db.union_all(
+        part(DueSolution, due=DueSolution.date),
+        part(Solution, flag="solved"),
+        part(DueComparison, flag="assigned"),
+        part(Comparison, flag="reviewed"),
+    ).subquery()
+    stmt = (
+        db.select(
+            rows.c.user_id,
+            rows.c.problem_id,
+            db.func.max(rows.c.due) <= now,
+            *(db.func.max(rows.c[name]) for name in flags),
+        )
+        .group_by(rows.c.user_id, rows.c.problem_id)
+        .having(db.func.max(rows.c.due).is_not(None))
+    )
+    return {
+        (user_id, problem_id): _progress_state(*flags)
+        for user_id, problem_id, *flags in S.execute(stmt)
+    }
+
+def _progress_state(passed, solved, assigned, reviewed):
+    if not solved:
+        return "late" if passed else None
+    if reviewed:
+        return "reviewed"
+    if assigned:
+        return "pending"
+    return "submitted"
+
+def read_progress(group_id=None, now=None):
+    # Users (members of group_id, or everyone with a problem due) by the problems due to them:
+    # dict(users, problems, rows of (user, [state or None for each problem]), totals by state)
+    progress, expires = _progress.get(group_id, (None, 0))
+    if expires >= time.monotonic():
+        return progress
+
+    if group_id is not None:
+        users = db.select(memberships.c.user_id).where(memberships.c.group_id == group_id)
+    else:
+        users = db.select(DueSolution.user_id).distinct()
+    cells = _progress_cells(users, now or datetime.now())
+    user_list = list(S.execute(
+        db.select(User.id, User.name).where(User.id.in_(sorted({u for u, _ in cells}))).order_by(User.name)
+    ))
+    problem_list = list(S.execute(
+        db.select(Problem.id, Problem.short).where(Problem.id.in_(sorted({p for _, p in cells}))).order_by(Problem.id)
+    ))
+    totals = {problem.id: dict.fromkeys(PROGRESS_STATES, 0) for problem in problem_list}
+    for (_, problem_id), state in cells.items():
+        if state is not None:
+            totals[problem_id][state] += 1
+    progress = dict(
+        users=user_list,
+        problems=problem_list,
+        rows=[
+            (user, [cells.get((user.id, problem.id)) for problem in problem_list])
+            for user in user_list
+        ],
+        totals=totals,
+    )
+    _progress[group_id] = (progress, time.monotonic() + PROGRESS_TTL)
+    return progress
+
+def forget_progress():
+    _progress.clear()
+
+
 ## Relationships
 
 def set_membership(user, group, value=True):
@@ -371,67 +976,596 @@ def set_membership(user, group, value=True):
         group.users.append(user)
     elif (not value) and (user in group.users):
         group.users = [ u for u in group.users if u != user ]
-    S.commit()
+    refresh_standings([user.id])
+    _commit()
+    forget_counts()
+    forget_progress()
+    forget_fragments("members", group.id)
+
+def _as_list(arg):
+    return list(arg) if isinstance(arg, (list, tuple, set)) else [arg]
+
+def _batch(*args):
+    # The add_* helpers take single values or lists of them (scalars go with every item):
+    # rows of arguments, and whether any was a list
+    many = any(isinstance(arg, (list, tuple)) for arg in args)
+    n = max((len(arg) for arg in args if isinstance(arg, (list, tuple))), default=1)
+    return list(zip(*(arg if isinstance(arg, (list, tuple)) else [arg] * n for arg in args))), many
+
+def _upsert(model, values, index_elements, update=()):
+    # A single INSERT ... ON CONFLICT for every row, returning the rows in the order of values.
+    # Conflicting rows get the columns in update, or are left as they are.
+    stmt = _insert(model)
+    set_ = {column: stmt.excluded[column] for column in update or index_elements[:1]}
+    stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=set_)
+    return list(S.scalars(
+        stmt.returning(model, sort_by_parameter_order=True),
+        values,
+        execution_options={"populate_existing": True},
+    ))
+
+def _insert(model):
+    # Dialect specific INSERT, so that callers can use on_conflict_do_update
+    if S.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
 
 def set_due_solution(group, problem, date, set_to=True):
-    users = read_group(group).users
+    # group and problem may also be lists: every member of every group gets every problem
+    group_ids = [read_group(g).id for g in _as_list(group)]
+    problem_ids = [read_problem(p).id for p in _as_list(problem)]
+    members = db.select(memberships.c.user_id).where(memberships.c.group_id.in_(group_ids))
+
+    if set_to is True:
+        stmt = _insert(DueSolution).from_select(
+            ["user_id", "problem_id", "date"],
+            db.select(memberships.c.user_id, Problem.id, db.literal(date, db.DateTime))
+            .join(Problem, db.true())
+            .where(memberships.c.group_id.in_(group_ids), Problem.id.in_(problem_ids))
+            .distinct(),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "problem_id"],
+            set_={"date": stmt.excluded.date},
+        )
+    else:
+        stmt = db.delete(DueSolution).where(
+            DueSolution.user_id.in_(members),
+            DueSolution.problem_id.in_(problem_ids),
+        )
+    S.execute(stmt)
+    bump_versions(members, problem_ids)
+    refresh_standings(members, problem_ids)
+    _commit()
+    forget_progress()
+    deadlines_changed.set()
+
+def assign_reviews(reviewers, solvers, seed=None, clusters=()):
+    # Solvers sit on a shuffled ring and each one compares the two solutions before them,
+    # so that every solution gets exactly two reviews. Reviewers without a solution of their
+    # own walk the same ring two slots at a time, spreading the extra reviews evenly.
+    # Solvers in the same cluster (sets of user ids with near-identical solutions, biggest
+    # first) are dealt to alternate slots, so that they are not compared against each other.
+    rng = random.Random(seed)
+    ring = sorted(set(solvers))
+    rng.shuffle(ring)
+    others = sorted(set(reviewers) - set(ring))
+    rng.shuffle(others)
+
+    n = len(ring)
+    if clusters:
+        label = {user_id: k for k, cluster in enumerate(clusters) for user_id in cluster}
+        order = sorted(ring, key=lambda user_id: label.get(user_id, len(clusters)))
+        for slot, user_id in zip(chain(range(0, n, 2), range(1, n, 2)), order):
+            ring[slot] = user_id
+
+    pairs = {}
+    if n >= 3:
+        for i, user_id in enumerate(ring):
+            pairs[user_id] = (ring[i-1], ring[i-2])
+    if n >= 2:
+        for j, user_id in enumerate(others):
+            pairs[user_id] = (ring[(2*j) % n], ring[(2*j+1) % n])
+    return pairs
+
+def _set_due_comparison(group, problem, date, set_to, force, seed, now=None):
+    group = read_group(group)
     problem = read_problem(problem)
-    for user in users:
-        due = S.query(DueSolution).filter_by(user_id=user.id, problem_id=problem.id).first()
-        if set_to is True and due is None:
-            due = DueSolution(user_id=user.id, problem_id=problem.id, date=date)
-            S.add(due)
-        elif set_to is True and due is not None:
-            due.date = date
-        elif set_to is False and due is not None:
-            S.delete(due)
-    S.commit()
-
-def _set_due_comparison(user, user1, user2, problem, date, set_to, force):
-    due = S.query(DueSolution).filter(
-        DueSolution.user_id == user.id,
-        DueSolution.problem_id == problem.id,
-        DueSolution.date < datetime.now()
-    ).first()
+    members = db.select(memberships.c.user_id).where(memberships.c.group_id == group.id)
+
+    if set_to is False:
+        S.execute(db.delete(DueComparisonTarget).where(
+            DueComparisonTarget.user_id.in_(members),
+            DueComparisonTarget.problem_id == problem.id,
+        ))
+        S.execute(db.delete(DueComparison).where(
+            DueComparison.user_id.in_(members),
+            DueComparison.problem_id == problem.id,
+        ))
+        bump_versions(members, [problem.id])
+        refresh_standings(members, [problem.id])
+        _commit()
+        forget_progress()
+        return
 
-    if not due:
+    rows = (
+        S.query(DueSolution.user_id, Solution.id)
+        .outerjoin(Solution, db.and_(
+            Solution.user_id == DueSolution.user_id,
+            Solution.problem_id == DueSolution.problem_id,
+        ))
+        .filter(
+            DueSolution.user_id.in_(members),
+            DueSolution.problem_id == problem.id,
+            DueSolution.date < (now or datetime.now()),
+        )
+        .all()
+    )
+    if not rows:
         warn("Should not compare solutions that are not past due.")
         return
-    
-    due = S.query(DueComparison).filter(
-        DueComparison.user_id == user.id,
-        DueComparison.problem_id == problem.id
-    ).first()
-    others = f"{user1.id};{user2.id}"
-
-    if due is None and set_to is True:
-        due = DueComparison(user_id=user.id, others=others, problem_id=problem.id, date=date)
-        S.add(due)
-    elif due is not None and set_to is True and force is True:
-        due.date = date
-        due.others = others
-    elif due is not None and set_to is False: 
-        S.delete(due)
-    S.commit()
 
-def set_due_comparison(group=None, problem=None, date=None, set_to=True, force=False):
+    pairs = assign_reviews(
+        reviewers=[user_id for user_id, _ in rows],
+        solvers=[user_id for user_id, solution_id in rows if solution_id is not None],
+        seed=seed,
+        clusters=[{s.user_id for s in cluster} for cluster in browse_duplicate_clusters(problem)],
+    )
+    if not pairs:
+        warn(f"Not enough solutions of {problem.short} in {group.name} to compare.")
+        return
+
+    if force is not True:
+        assigned = db.select(DueComparison.user_id).where(
+            DueComparison.user_id.in_(members),
+            DueComparison.problem_id == problem.id,
+        )
+        assigned = set(S.scalars(assigned))
+        pairs = {user_id: pair for user_id, pair in pairs.items() if user_id not in assigned}
+        if not pairs:
+            return
+
+    stmt = _insert(DueComparison)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "problem_id"],
+        set_={"date": stmt.excluded.date},
+    )
+    S.execute(stmt, [
+        dict(user_id=user_id, problem_id=problem.id, date=date)
+        for user_id in pairs
+    ])
+    S.execute(db.delete(DueComparisonTarget).where(
+        DueComparisonTarget.user_id.in_(list(pairs)),
+        DueComparisonTarget.problem_id == problem.id,
+    ))
+    S.execute(db.insert(DueComparisonTarget), [
+        dict(user_id=user_id, problem_id=problem.id, position=position, reviewed_id=reviewed_id)
+        for user_id, pair in pairs.items()
+        for position, reviewed_id in enumerate(pair)
+    ])
+    bump_versions(list(pairs), [problem.id])
+    refresh_standings(list(pairs), [problem.id])
+    _commit()
+    forget_progress()
+
+def set_due_comparison(group=None, problem=None, date=None, set_to=True, force=False, seed=None):
     if group is None:
-        for g in S.query(Group).all():
-            set_due_comparison(g, problem, date, set_to)
+        with unit_of_work():
+            for g in S.query(Group).all():
+                set_due_comparison(g, problem, date, set_to, force, seed)
         return
     if problem is None:
-        for due in S.query(DueSolution).filter(
-            DueSolution.date < datetime.now(),
-            DueSolution.date > datetime.now() - timedelta(days=14)
-        ):
-            problem = S.get(Problem, due.problem_id)
-            set_due_comparison(group, due.problem_id, date, set_to)
+        with unit_of_work():
+            for problem_id, in S.query(DueSolution.problem_id).filter(
+                DueSolution.date < datetime.now(),
+                DueSolution.date > datetime.now() - timedelta(days=14)
+            ).distinct().all():
+                set_due_comparison(group, problem_id, date, set_to, force, seed)
         return
     if date is None:
         date = datetime.now() + timedelta(days=7)
-    users = list(read_group(group).users)
+    _set_due_comparison(group, problem, date, set_to, force, seed)
+
+
+def browse_reviewers(user, problem):
+    # Who has been asked to review the solution of user to problem
+    user = read_user(user)
     problem = read_problem(problem)
-    random.shuffle(users)
-    for i, user in enumerate(users):
-        _set_due_comparison(user, users[i-1], users[i-2], problem, date, set_to, force)
+    return list(S.scalars(
+        db.select(DueComparisonTarget.user_id).where(
+            DueComparisonTarget.reviewed_id == user.id,
+            DueComparisonTarget.problem_id == problem.id,
+        )
+    ))
+
+def read_review_load(problem):
+    # Number of reviewers assigned to each solution of problem
+    problem = read_problem(problem)
+    return dict(S.execute(
+        db.select(DueComparisonTarget.reviewed_id, db.func.count())
+        .where(DueComparisonTarget.problem_id == problem.id)
+        .group_by(DueComparisonTarget.reviewed_id)
+    ).all())
+
+## Loaders
+
+def browse_inbound_comparisons(user, problem):
+    # Comparisons that judged the solution of user, with everything user_solve.html shows
+    # loaded upfront: (comparisons where user won, comparisons where user lost)
+    user = read_user(user)
+    problem = read_problem(problem)
+    comparisons = (
+        S.query(Comparison)
+        .options(
+            db.joinedload(Comparison.user),
+            db.joinedload(Comparison.better_user),
+            db.joinedload(Comparison.worse_user),
+            db.joinedload(Comparison.better_solution),
+            db.joinedload(Comparison.worse_solution),
+        )
+        .filter(
+            Comparison.problem_id == problem.id,
+            db.or_(Comparison.better == user.id, Comparison.worse == user.id),
+        )
+        .order_by(Comparison.id)
+        .all()
+    )
+    positive = [c for c in comparisons if c.better == user.id]
+    negative = [c for c in comparisons if c.worse == user.id]
+    return positive, negative
+
+
+def due_problem_fields(user_id, now):
+    # What the API can tell about each problem due for user_id, by field name
+    def count_comparisons(column):
+        return (
+            db.select(db.func.count())
+            .where(Comparison.problem_id == DueSolution.problem_id, column == user_id)
+            .correlate(DueSolution)
+            .scalar_subquery()
+        )
+
+    def reviewed(position):
+        return (
+            db.select(DueComparisonTarget.reviewed_id)
+            .where(
+                DueComparisonTarget.user_id == user_id,
+                DueComparisonTarget.problem_id == DueSolution.problem_id,
+                DueComparisonTarget.position == position,
+            )
+            .correlate(DueSolution)
+            .scalar_subquery()
+        )
+
+    return {
+        "id": DueSolution.problem_id,
+        "short": Problem.short,
+        "text": Problem.text,
+        "date": DueSolution.date,
+        "state": db.case(
+            (DueSolution.date < now, "past"),
+            (Solution.id.is_not(None), "solved"),
+            else_="unsolved",
+        ),
+        "solution": Solution.id,
+        "solution_text": Solution.solution_text,
+        "comparison_date": DueComparison.date,
+        "comparison_state": db.case(
+            (Comparison.id.is_not(None), "done"),
+            (DueComparison.date > now, "open"),
+            (DueComparison.user_id.is_not(None), "closed"),
+            else_=None,
+        ),
+        "left": reviewed(0),
+        "right": reviewed(1),
+        "better": Comparison.better,
+        "worse": Comparison.worse,
+        "motivation": Comparison.motivation,
+        "wins": count_comparisons(Comparison.better),
+        "losses": count_comparisons(Comparison.worse),
+    }
+
+def browse_due_problems(user, fields, problem=None, now=None):
+    # Rows with the requested fields of due_problem_fields, in deadline order
+    user = read_user(user)
+    now = now or datetime.now()
+    columns = due_problem_fields(user.id, now)
+    stmt = (
+        db.select(*(columns[name] for name in fields))
+        .select_from(DueSolution)
+        .join(Problem, Problem.id == DueSolution.problem_id)
+        .outerjoin(Solution, db.and_(
+            Solution.user_id == DueSolution.user_id,
+            Solution.problem_id == DueSolution.problem_id,
+        ))
+        .outerjoin(DueComparison, db.and_(
+            DueComparison.user_id == DueSolution.user_id,
+            DueComparison.problem_id == DueSolution.problem_id,
+        ))
+        .outerjoin(Comparison, db.and_(
+            Comparison.user_id == DueSolution.user_id,
+            Comparison.problem_id == DueSolution.problem_id,
+        ))
+        .where(DueSolution.user_id == user.id)
+        .order_by(DueSolution.date, DueSolution.problem_id)
+    )
+    if problem is not None:
+        stmt = stmt.where(DueSolution.problem_id == problem)
+    return S.execute(stmt).all()
+
+def member_fields():
+    return {
+        "id": User.id,
+        "name": User.name,
+        "points": User.points,
+        "solutions": (
+            db.select(db.func.count()).where(Solution.user_id == User.id)
+            .correlate(User).scalar_subquery()
+        ),
+        "comparisons": (
+            db.select(db.func.count()).where(Comparison.user_id == User.id)
+            .correlate(User).scalar_subquery()
+        ),
+    }
+
+def browse_roster(group, fields, after=None, limit=None):
+    # Rows with the requested fields of member_fields, plus the name as keyset cursor
+    group = read_group(group)
+    columns = member_fields()
+    stmt = (
+        db.select(*(columns[name] for name in fields), User.name)
+        .join(memberships, memberships.c.user_id == User.id)
+        .where(memberships.c.group_id == group.id)
+        .order_by(User.name)
+        .limit(limit or PAGE_SIZE)
+    )
+    if after is not None:
+        stmt = stmt.where(User.name > after)
+    return S.execute(stmt).all()
+
+
+def read_dashboard(user, now=None):
+    # Past, solved and unsolved problems of a user, in a single joined query
+    user = read_user(user)
+    now = now or datetime.now()
+    rows = (
+        S.query(
+            DueSolution.problem_id,
+            DueSolution.date,
+            Problem.short,
+            db.func.substr(Problem.text, 1, 40),
+            Solution.id,
+            DueComparison.date,
+            Comparison.id,
+        )
+        .join(Problem, Problem.id == DueSolution.problem_id)
+        .outerjoin(
+            Solution,
+            db.and_(
+                Solution.user_id == DueSolution.user_id,
+                Solution.problem_id == DueSolution.problem_id,
+            ),
+        )
+        .outerjoin(
+            DueComparison,
+            db.and_(
+                DueComparison.user_id == DueSolution.user_id,
+                DueComparison.problem_id == DueSolution.problem_id,
+                DueComparison.date > now,
+            ),
+        )
+        .outerjoin(
+            Comparison,
+            db.and_(
+                Comparison.user_id == DueSolution.user_id,
+                Comparison.problem_id == DueSolution.problem_id,
+            ),
+        )
+        .filter(DueSolution.user_id == user.id)
+        .order_by(DueSolution.date, DueSolution.problem_id)
+    )
+
+    past_problems, solved_problems, unsolved_problems = [], [], []
+    for problem_id, date, short, text, solution_id, comparison_date, comparison_id in rows:
+        problem = dict(
+            id=problem_id,
+            short=short,
+            text=text,
+            date=date,
+            solution=solution_id,
+            due_comparison=comparison_date,
+            comparison=comparison_id,
+        )
+        if date < now:
+            past_problems.append(problem)
+        elif solution_id is not None:
+            solved_problems.append(problem)
+        else:
+            unsolved_problems.append(problem)
+    return past_problems, solved_problems, unsolved_problems
         
+
+
+## Page versions
+# Pages send read_page_version as their ETag. Whatever changes a page bumps its version in
+# the same transaction; deadlines passing change it through the count of passed dates.
+
+def bump_versions(users, problems=()):
+    # users is a list of user ids or a select of them; the caller commits
+    stmt = _insert(PageVersion)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "problem_id"],
+        set_={"version": PageVersion.version + 1},
+    )
+    if isinstance(users, Select):
+        users = users.subquery()
+        for problem_id in [0, *problems]:
+            S.execute(stmt.from_select(
+                ["user_id", "problem_id", "version"],
+                db.select(users.c[0], db.literal(problem_id), db.literal(1)).where(db.true()),
+            ))
+        return
+    users = set(users)
+    if users:
+        S.execute(stmt, [
+            dict(user_id=user_id, problem_id=problem_id, version=1)
+            for user_id in users
+            for problem_id in [0, *problems]
+        ])
+
+def read_page_version(user, problem_id=0, now=None):
+    # Cheap enough to run on every request: primary key lookups and index-only counts
+    user_id = user.id
+    problem_id = int(problem_id)
+    now = now or datetime.now()
+
+    def version(user_id, problem_id):
+        return (
+            db.select(PageVersion.version)
+            .where(PageVersion.user_id == user_id, PageVersion.problem_id == problem_id)
+            .scalar_subquery()
+        )
+
+    def passed(model):
+        stmt = db.select(db.func.count()).where(model.user_id == user_id, model.date <= now)
+        if problem_id:
+            stmt = stmt.where(model.problem_id == problem_id)
+        return stmt.scalar_subquery()
+
+    row = S.execute(db.select(
+        version(user_id, problem_id),
+        version(0, 0),
+        passed(DueSolution),
+        passed(DueComparison),
+    )).one()
+    return "{}.{}.{}.{}".format(*(value or 0 for value in row))
+
+
+## Features
+# Search, similarity and deadlines have modules of their own. They build on the tables and
+# helpers above, which also call into them: imported here, once those are defined.
+from .deadlines import deadlines_changed
+from .search import index_problem, index_solution, rebuild_search_index, unindex
+from .similarity import browse_duplicate_clusters, sign_all_solutions, sign_solution, unsign_solution
+
+
+## Migrations
+# create_all only creates missing tables: changes to existing ones go in MIGRATIONS, which
+# migrate applies in order, once each, recording the version reached in schema_version.
+
+def migrate_due_comparison_others():
+    # Move the legacy "left;right" strings of due_comparison.others into due_comparison_target
+    columns = [c["name"] for c in db.inspect(S.get_bind()).get_columns("due_comparison")]
+    if "others" not in columns:
+        return
+    rows = S.execute(db.text(
+        "SELECT user_id, problem_id, others FROM due_comparison WHERE others IS NOT NULL"
+    )).all()
+    done = set(S.execute(db.select(DueComparisonTarget.user_id, DueComparisonTarget.problem_id)).all())
+    targets = [
+        dict(user_id=user_id, problem_id=problem_id, position=position, reviewed_id=int(reviewed_id))
+        for user_id, problem_id, others in rows
+        if (user_id, problem_id) not in done
+        for position, reviewed_id in enumerate(others.split(";"))
+    ]
+    if targets:
+        S.execute(db.insert(DueComparisonTarget), targets)
+    S.execute(db.text("UPDATE due_comparison SET others = NULL"))
+    S.commit()
+
+def _create_indexes(*names):
+    indexes = {index.name: index for table in db.metadata.sorted_tables for index in table.indexes}
+    for name in names:
+        indexes[name].create(S.connection(), checkfirst=True)
+
+def _duplicate_ids(model, *columns, latest=True):
+    # Ids of the rows that repeat columns, all but the latest (or the oldest) of each group
+    keep = db.func.max(model.id) if latest else db.func.min(model.id)
+    kept = db.select(keep).group_by(*columns)
+    return list(S.scalars(db.select(model.id).where(model.id.not_in(kept)).order_by(model.id)))
+
+def _drop_duplicate_solutions_and_comparisons():
+    # Racing submissions and compares could store the same (user, problem) twice: the latest
+    # row wins, before the unique indexes below go in
+    for solution_id in _duplicate_ids(Solution, Solution.user_id, Solution.problem_id):
+        unindex(solution_id=solution_id)
+        unsign_solution(solution_id)
+        S.execute(db.delete(Solution).where(Solution.id == solution_id))
+    duplicates = _duplicate_ids(Comparison, Comparison.user_id, Comparison.problem_id)
+    if duplicates:
+        S.execute(db.delete(Comparison).where(Comparison.id.in_(duplicates)))
+        warn(f"Dropped {len(duplicates)} duplicate comparisons: refit_points() recomputes the points")
+
+def _rename_duplicate_shorts():
+    # The oldest problem keeps its short, the others get their id appended, before
+    # ix_problem_short goes in as a unique index
+    for problem_id in _duplicate_ids(Problem, Problem.short, latest=False):
+        p = S.get(Problem, problem_id)
+        short = f"{p.short} ({p.id})"
+        while S.scalar(db.select(Problem.id).where(Problem.short == short)) is not None:
+            short = f"{short} ({p.id})"
+        warn(f"Renamed problem {p.id} from {p.short} to {short}: another problem had the same short")
+        p.short = short
+        S.flush()
+        index_problem(p)
+
+def _add_dashboard_indexes():
+    _drop_duplicate_solutions_and_comparisons()
+    _rename_duplicate_shorts()
+    _create_indexes(
+        "ix_problem_short",
+        "ix_due_solution_date",
+        "ix_due_solution_user_date",
+        "ix_due_comparison_user_problem_date",
+        "ix_solution_user_problem",
+        "ix_comparison_user_problem",
+        "ix_comparison_problem_better",
+        "ix_comparison_problem_worse",
+    )
+
+def _make_problem_short_unique():
+    _rename_duplicate_shorts()
+    S.execute(db.text("DROP INDEX IF EXISTS ix_problem_short"))
+    _create_indexes("ix_problem_short")
+
+def _add_user_token_index():
+    # Users sharing a token keep it on the oldest account, the others get a new one
+    duplicates = S.scalars(
+        db.select(User.id).where(
+            User.id.not_in(db.select(db.func.min(User.id)).group_by(User.token))
+        )
+    ).all()
+    for user_id in duplicates:
+        S.execute(db.update(User).where(User.id == user_id).values(token=uuid.uuid4().hex.upper()[:16]))
+    if duplicates:
+        warn(f"Gave a new token to {len(duplicates)} users that shared theirs")
+    S.execute(db.text("DROP INDEX IF EXISTS ix_user_token"))
+    _create_indexes("ix_user_token")
+
+MIGRATIONS = [
+    (1, migrate_due_comparison_others),
+    (2, _add_dashboard_indexes),
+    (3, _make_problem_short_unique),
+    (4, refresh_standings),
+    (5, _add_user_token_index),
+    (6, sign_all_solutions),
+    (7, rebuild_search_index),
+    (8, refit_points),
+]
+
+def read_schema_version():
+    return S.scalar(db.select(db.func.max(SchemaVersion.version))) or 0
+
+def migrate():
+    current = read_schema_version()
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            step()
+            S.add(SchemaVersion(version=version, date=datetime.now()))
+            S.commit()
+        except Exception:
+            S.rollback()
+            raise
+    return read_schema_version()
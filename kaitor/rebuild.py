@@ -0,0 +1,40 @@
+"""Rebuild the tables derived from solutions and comparisons.
+
+After an import, or any change made to the database outside the helpers of models.py:
+
+    python -m kaitor.rebuild --db sqlite:///site.db standings search
+"""
+import argparse
+
+from .app_factory import create_app
+from .models import rebuild_standings, refit_points
+from .search import rebuild_search_index
+from .similarity import sign_all_solutions
+
+TASKS = {
+    "standings": rebuild_standings,
+    "search": rebuild_search_index,
+    "signatures": sign_all_solutions,
+    "points": refit_points,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="sqlite:///site.db", help="database URI")
+    parser.add_argument("tasks", nargs="*", metavar="task",
+                        help=f"what to rebuild, among {', '.join(TASKS)}; the standings by default")
+    args = parser.parse_args(argv)
+    unknown = [task for task in args.tasks if task not in TASKS]
+    if unknown:
+        parser.error(f"unknown tasks: {', '.join(unknown)}")
+
+    app = create_app(db_uri=args.db)
+    with app.app_context():
+        for task in args.tasks or ["standings"]:
+            TASKS[task]()
+            print(f"Rebuilt {task}")
+
+
+if __name__ == "__main__":
+    main()
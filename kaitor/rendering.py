@@ -0,0 +1,114 @@
+"""Rendering of problem and solution texts.
+
+Markdown with $...$, $$...$$, \(...\) and \[...\] formulas rendered to HTML and MathML on the
+server, cached by content hash
+"""
+from collections import OrderedDict
+import hashlib
+from html import unescape as unescape_entities
+import re
+import threading
+import uuid
+from xml.etree.ElementTree import tostring as xml_tostring
+
+from latex2mathml.converter import convert_to_element as latex_to_mathml_element
+import markdown
+from markdown.treeprocessors import Treeprocessor
+from markupsafe import Markup, escape
+
+
+RENDER_CACHE_SIZE = 2048
+_rendered = OrderedDict()
+_rendered_lock = threading.Lock()
+_FORMULA = re.compile(r"\$\$(.+?)\$\$|\\\[(.+?)\\\]|\$([^$\n]+?)\$|\\\((.+?)\\\)", re.S)
+_URL_ATTRIBUTES = ("href", "src")
+
+def _safe_url(url):
+    # Relative links and http(s) only: no javascript:, data: and the like
+    scheme = re.match(r"([^/?#]*):", re.sub(r"[\x00-\x20\x7f]+", "", url))
+    return scheme is None or scheme.group(1).lower() in ("http", "https")
+
+def _clean_attributes(element):
+    for name, value in list(element.attrib.items()):
+        if name == "style" or name.startswith("on") or (name in _URL_ATTRIBUTES and not _safe_url(value)):
+            del element.attrib[name]
+
+def _mathml(match):
+    # Serialized from the element tree, so that text and attribute values are escaped:
+    # latex2mathml writes its symbols as entities in the text, those become characters first
+    block, bracket, inline, paren = match.groups()
+    try:
+        math = latex_to_mathml_element(
+            (block or bracket or inline or paren).strip(),
+            display="block" if (block or bracket) else "inline",
+        )
+    except Exception:
+        return str(escape(match.group(0)))
+    for element in math.iter():
+        element.text = element.text and unescape_entities(element.text)
+        element.tail = element.tail and unescape_entities(element.tail)
+        _clean_attributes(element)
+    return xml_tostring(math, encoding="unicode")
+
+class _Sanitizer(Treeprocessor):
+    # Last pass over the Markdown tree: unsafe links go, and formulas that ended up in an
+    # attribute (a link target, an image description) are put back as their LaTeX source
+    def __init__(self, md, placeholder, sources):
+        super().__init__(md)
+        self.placeholder = placeholder
+        self.sources = sources
+
+    def run(self, root):
+        for element in root.iter():
+            for name, value in element.attrib.items():
+                element.set(name, _put_back(self.placeholder, self.sources, value))
+            _clean_attributes(element)
+
+def _put_back(placeholder, values, text):
+    # Unknown indexes are left as they are
+    return placeholder.sub(
+        lambda m: values[int(m.group(1))] if int(m.group(1)) < len(values) else m.group(0), text,
+    )
+
+def _render(text):
+    # Formulas are swapped for placeholders, so that Markdown does not touch the LaTeX source.
+    # The placeholders carry a random nonce, so that no text can imitate them.
+    nonce = uuid.uuid4().hex
+    placeholder = re.compile(f"KAITORMATH{nonce}N(\\d+)X")
+    formulas = []
+    sources = []
+    def stash(match):
+        formulas.append(_mathml(match))
+        sources.append(match.group(0))
+        return f"KAITORMATH{nonce}N{len(formulas) - 1}X"
+
+    md = markdown.Markdown(extensions=["fenced_code"])
+    md.preprocessors.deregister("html_block")
+    md.inlinePatterns.deregister("html")
+    md.treeprocessors.register(_Sanitizer(md, placeholder, sources), "kaitor_sanitizer", 0)
+    html = md.convert(_FORMULA.sub(stash, text))
+    return _put_back(placeholder, formulas, html)
+
+def _digest(text):
+    return hashlib.sha256(text.encode()).digest()
+
+def render_markdown(text):
+    if not text:
+        return Markup("")
+    key = _digest(text)
+    with _rendered_lock:
+        html = _rendered.get(key)
+        if html is not None:
+            _rendered.move_to_end(key)
+    if html is None:
+        html = _render(text)
+        with _rendered_lock:
+            _rendered[key] = html
+            if len(_rendered) > RENDER_CACHE_SIZE:
+                _rendered.popitem(last=False)
+    return Markup(html)
+
+def forget_rendered(text):
+    if text:
+        with _rendered_lock:
+            _rendered.pop(_digest(text), None)
@@ -0,0 +1,38 @@
+"""Open comparisons for the deadlines that passed since the last run, and refit the points.
+
+Meant for cron, e.g. every five minutes:
+
+    */5 * * * * cd /path/to/flaskapi && python -m kaitor.scheduler --db sqlite:///site.db
+
+With --loop it keeps running and wakes up at each deadline instead. An app can also run the
+same loop in a background thread, with kaitor.init_app(app, scheduler=True).
+"""
+import argparse
+
+from .app_factory import create_app
+from .deadlines import (SCHEDULER_INTERVAL, DeadlineScheduler, open_due_comparisons, read_next_deadline,
+                        refresh_points)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="sqlite:///site.db", help="database URI")
+    parser.add_argument("--loop", action="store_true", help="keep running in the foreground")
+    parser.add_argument("--interval", type=int, default=SCHEDULER_INTERVAL, help="longest sleep, in seconds")
+    args = parser.parse_args(argv)
+
+    app = create_app(db_uri=args.db)
+    if args.loop:
+        DeadlineScheduler(app, interval=args.interval).run()
+        return
+
+    with app.app_context():
+        for group_id, problem_id in open_due_comparisons():
+            print(f"Opened comparisons of problem {problem_id} for group {group_id}")
+        if refresh_points():
+            print("Refitted the points")
+        print(f"Next deadline: {read_next_deadline()}")
+
+
+if __name__ == "__main__":
+    main()
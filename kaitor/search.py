@@ -0,0 +1,112 @@
+"""Full-text search over problems and solutions.
+
+SQLite FTS5 index over problems and solutions. Problem rows have rowid 2 * id and solution
+rows 2 * id + 1, so that the helpers replace or drop them without a lookup.
+"""
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, event
+
+from .models import PAGE_SIZE, Problem, S, Solution, _commit, db
+
+
+event.listen(
+    db.metadata,
+    "after_create",
+    DDL(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+        "kind UNINDEXED, ref UNINDEXED, problem_id UNINDEXED, short, text, "
+        "tokenize='unicode61 remove_diacritics 2')"
+    ).execute_if(dialect="sqlite"),
+)
+
+def _fts():
+    return S.get_bind().dialect.name == "sqlite"
+
+def _index(rowid, kind, ref, problem_id, short, text):
+    if not _fts():
+        return
+    S.execute(db.text("DELETE FROM search_index WHERE rowid = :rowid"), dict(rowid=rowid))
+    S.execute(
+        db.text(
+            "INSERT INTO search_index (rowid, kind, ref, problem_id, short, text) "
+            "VALUES (:rowid, :kind, :ref, :problem_id, :short, :text)"
+        ),
+        dict(rowid=rowid, kind=kind, ref=ref, problem_id=problem_id, short=short, text=text),
+    )
+
+def index_problem(p):
+    _index(2 * p.id, "problem", p.id, p.id, p.short, p.text)
+
+def index_solution(s):
+    _index(2 * s.id + 1, "solution", s.id, s.problem_id, None, s.solution_text)
+
+def unindex(problem_id=None, solution_id=None):
+    if not _fts():
+        return
+    rowid = 2 * problem_id if problem_id is not None else 2 * solution_id + 1
+    S.execute(db.text("DELETE FROM search_index WHERE rowid = :rowid"), dict(rowid=rowid))
+
+def rebuild_search_index():
+    if not _fts():
+        return
+    S.execute(db.text("DELETE FROM search_index"))
+    S.execute(db.text(
+        "INSERT INTO search_index (rowid, kind, ref, problem_id, short, text) "
+        "SELECT 2 * id, 'problem', id, id, short, text FROM problem"
+    ))
+    S.execute(db.text(
+        "INSERT INTO search_index (rowid, kind, ref, problem_id, short, text) "
+        "SELECT 2 * id + 1, 'solution', id, problem_id, NULL, solution_text FROM solution"
+    ))
+    _commit()
+
+def search(query, kind=None, offset=0, limit=PAGE_SIZE):
+    # Best matches first; every word must appear, the last one may be a prefix
+    words = query.split()
+    if not words:
+        return []
+    if not _fts():
+        return _search_like(words, kind, offset, limit)
+
+    match = " ".join('"{}"'.format(w.replace('"', '""')) for w in words) + "*"
+    rows = S.execute(
+        db.text(
+            "SELECT kind, ref, problem_id, short, "
+            "snippet(search_index, 4, char(2), char(3), '...', 16), "
+            "bm25(search_index, 0, 0, 0, 5.0, 1.0) AS rank "
+            "FROM search_index WHERE search_index MATCH :match "
+            + ("AND kind = :kind " if kind else "")
+            + "ORDER BY rank LIMIT :limit OFFSET :offset"
+        ),
+        dict(match=match, kind=kind, limit=limit, offset=offset),
+    )
+    return [
+        dict(
+            kind=kind,
+            id=ref,
+            problem_id=problem_id,
+            short=short,
+            snippet=Markup(str(escape(snippet)).replace("\x02", "<mark>").replace("\x03", "</mark>")),
+            rank=rank,
+        )
+        for kind, ref, problem_id, short, snippet, rank in rows
+    ]
+
+def _search_like(words, kind, offset, limit):
+    # Unranked fallback for databases without FTS5
+    results = []
+    if kind in (None, "problem"):
+        results += [
+            dict(kind="problem", id=p.id, problem_id=p.id, short=p.short, snippet=p.text[:120], rank=0)
+            for p in S.query(Problem).filter(*[
+                db.or_(Problem.short.ilike(f"%{w}%"), Problem.text.ilike(f"%{w}%")) for w in words
+            ]).order_by(Problem.id)
+        ]
+    if kind in (None, "solution"):
+        results += [
+            dict(kind="solution", id=s.id, problem_id=s.problem_id, short=None, snippet=s.solution_text[:120], rank=0)
+            for s in S.query(Solution).filter(*[
+                Solution.solution_text.ilike(f"%{w}%") for w in words
+            ]).order_by(Solution.id)
+        ]
+    return results[offset:offset + limit]
@@ -0,0 +1,114 @@
+"""Near-duplicate detection among the solutions to a problem.
+
+MinHash signatures over character shingles of the normalized text, split into BANDS bands
+for locality-sensitive hashing: two solutions with Jaccard similarity J share at least one
+bucket with probability 1 - (1 - J^(NUM_PERM / BANDS))^BANDS: about 0.61 for J = 0.7
+and 0.95 at the DUPLICATE_THRESHOLD of 0.8.
+"""
+import hashlib
+import zlib
+
+import numpy as np
+
+from .models import S, Solution, SolutionBand, SolutionSignature, _commit, db, read_problem
+
+
+NUM_PERM = 128
+BANDS = 16
+SHINGLE = 5
+DUPLICATE_THRESHOLD = 0.8
+# Hashes (a·x + b) mod p with a, b and x (a CRC32) all below 2^32, so that a·x + b stays
+# below 2^64 and the uint64 arithmetic never wraps
+_PRIME = np.uint64(4294967311)
+_A, _B = (
+    np.random.RandomState(20240330).randint(1, 2**32, size=(2, NUM_PERM), dtype=np.int64)
+    .astype(np.uint64)
+)
+
+def minhash(text):
+    text = " ".join(text.lower().split())
+    shingles = {text[i:i + SHINGLE] for i in range(max(1, len(text) - SHINGLE + 1))}
+    x = np.fromiter((zlib.crc32(sh.encode()) for sh in shingles), dtype=np.uint64, count=len(shingles))
+    x %= _PRIME
+    return ((_A[:, None] * x[None, :] + _B[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+def _buckets(signature):
+    return [
+        int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), "big", signed=True)
+        for band in np.split(signature, BANDS)
+    ]
+
+def unsign_solution(solution_id):
+    S.execute(db.delete(SolutionBand).where(SolutionBand.solution_id == solution_id))
+    S.execute(db.delete(SolutionSignature).where(SolutionSignature.solution_id == solution_id))
+
+def sign_solution(s):
+    # The caller commits
+    signature = minhash(s.solution_text)
+    unsign_solution(s.id)
+    S.add(SolutionSignature(solution_id=s.id, problem_id=s.problem_id, signature=signature.tobytes()))
+    S.execute(db.insert(SolutionBand), [
+        dict(problem_id=s.problem_id, band=band, bucket=bucket, solution_id=s.id)
+        for band, bucket in enumerate(_buckets(signature))
+    ])
+
+def sign_all_solutions():
+    # Plain rows: the joined relationships of Solution rule out yield_per on the entity
+    rows = S.execute(
+        db.select(Solution.id, Solution.problem_id, Solution.solution_text)
+        .execution_options(yield_per=1000)
+    )
+    for s in rows:
+        sign_solution(s)
+    _commit()
+
+def find_root(parent, x):
+    # Union-find with path halving: every other node on the way up skips to its grandparent
+    while parent.get(x, x) != x:
+        parent[x] = parent.get(parent[x], parent[x])
+        x = parent[x]
+    return x
+
+def browse_duplicate_clusters(problem, threshold=DUPLICATE_THRESHOLD):
+    # Groups of solutions to problem that are likely copies of each other, biggest first.
+    # Only solutions sharing a bucket are compared, each one against the first of the bucket.
+    problem = read_problem(problem)
+    signatures = {
+        solution_id: np.frombuffer(signature, dtype=np.uint32)
+        for solution_id, signature in S.execute(
+            db.select(SolutionSignature.solution_id, SolutionSignature.signature)
+            .where(SolutionSignature.problem_id == problem.id)
+        )
+    }
+    parent = {}
+    def find(x):
+        return find_root(parent, x)
+
+    first = None
+    previous = None
+    for band, bucket, solution_id in S.execute(
+        db.select(SolutionBand.band, SolutionBand.bucket, SolutionBand.solution_id)
+        .where(SolutionBand.problem_id == problem.id)
+        .order_by(SolutionBand.band, SolutionBand.bucket, SolutionBand.solution_id)
+    ):
+        if (band, bucket) != previous:
+            previous, first = (band, bucket), solution_id
+            continue
+        if np.mean(signatures[first] == signatures[solution_id]) >= threshold:
+            parent[find(solution_id)] = find(first)
+
+    clusters = {}
+    for solution_id in parent:
+        clusters.setdefault(find(solution_id), set()).add(solution_id)
+    for root in list(clusters):
+        clusters[root].add(root)
+    ids = set().union(*clusters.values())
+    solutions = {
+        s.id: s for s in
+        S.query(Solution).options(db.joinedload(Solution.user)).filter(Solution.id.in_(ids))
+    } if ids else {}
+    return sorted(
+        ([solutions[i] for i in sorted(cluster)] for cluster in clusters.values()),
+        key=len,
+        reverse=True,
+    )
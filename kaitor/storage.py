@@ -1,53 +1,140 @@
+import json
+from textwrap import indent
+
 import yaml
-from models import Group, User, db, memberships, S
+from .models import (Group, User, db, forget_counts, forget_fragments, forget_progress, forget_token,
+                     memberships, refresh_standings, S)
+
+# Use the libyaml bindings when they are available
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+BATCH_SIZE = 1000
+
+
+def _is_jsonl(path):
+    return str(path).endswith((".jsonl", ".ndjson"))
+
+
+def _stream(stmt):
+    return S.execute(stmt.execution_options(yield_per=BATCH_SIZE))
+
+
+def _records():
+    # Every record of the roster, groups and users before the memberships that refer to them
+    for id, name in _stream(db.select(Group.id, Group.name).order_by(Group.id)):
+        yield "group", id, name
+    for id, name, password, points, token in _stream(
+        db.select(User.id, User.name, User.password, User.points, User.token).order_by(User.id)
+    ):
+        yield "user", id, dict(name=name, password=password, points=points, token=token)
+    for group_name, user_name in _stream(
+        db.select(Group.name, User.name)
+        .select_from(memberships)
+        .join(Group, Group.id == memberships.c.group_id)
+        .join(User, User.id == memberships.c.user_id)
+        .order_by(Group.id, User.id)
+    ):
+        yield "member", group_name, user_name
 
 
 def export_members(path):
-    groups = {group.id: group.name for group in S.query(Group).all()}
-    users = {
-        user.id: {
-            "name": user.name,
-            "password": user.password,
-            "points": user.points,
-            "token": user.token,
-        }
-        for user in S.query(User).all()
-    }
-    members = {
-        group.name: [user.name for user in group.users]
-        for group in S.query(Group).all()
-    }
-    with open(path, "w") as f:
-        f.write(yaml.dump({"members": members, "groups": groups, "users": users}))
+    with open(path, "w", encoding="utf-8") as f:
+        if _is_jsonl(path):
+            for kind, key, value in _records():
+                if kind == "group":
+                    record = dict(type=kind, id=key, name=value)
+                elif kind == "user":
+                    record = dict(type=kind, id=key, **value)
+                else:
+                    record = dict(type=kind, group=key, user=value)
+                f.write(json.dumps(record) + "\n")
+            return
 
+        # Same document as yaml.dump({"members": ..., "groups": ..., "users": ...}),
+        # written one entry at a time. Memberships come sorted by group, so each group
+        # opens its list once and the following members are appended to it.
+        section = group_name = None
+        for kind, key, value in _records():
+            if kind != section:
+                section = kind
+                f.write(f"{kind}s:\n")
+            if kind != "member":
+                entry = {key: value}
+            elif key != group_name:
+                group_name = key
+                entry = {key: [value]}
+            else:
+                entry = [value]
+            f.write(indent(yaml.dump(entry, Dumper=SafeDumper), "  "))
 
-def import_members(path, drop=False):
-    with open(path, "r") as f:
-        data = yaml.safe_load(f.read())
 
+def _read_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        if _is_jsonl(path):
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    kind = record.pop("type")
+                    if kind == "group":
+                        yield kind, record["id"], record["name"]
+                    elif kind == "user":
+                        yield kind, record.pop("id"), record
+                    else:
+                        yield kind, record["group"], record["user"]
+            return
+
+        # An empty roster exports to an empty document, which loads as None
+        data = yaml.load(f, Loader=SafeLoader) or {}
+    for id, name in (data.get("groups") or {}).items():
+        yield "group", id, name
+    for id, user in (data.get("users") or {}).items():
+        yield "user", id, user
+    for group_name, user_names in (data.get("members") or {}).items():
+        for user_name in user_names:
+            yield "member", group_name, user_name
+
+
+def import_members(path, drop=False):
     if drop:
+        memberships.drop(db.engine)
         Group.__table__.drop(db.engine)
         User.__table__.drop(db.engine)
-        memberships.drop(db.engine)
         db.create_all()
 
-    groups = data["groups"]
-    for id, name in groups.items():
-        group_name = Group(id=id, name=name)
-        S.add(group_name)
-        S.commit()
-    reverse_group = { name: id for id, name in groups.items() }
-
-    users = data["users"]
-    for id, user in users.items():
-        u = User(id=id, **user)
-        S.add(u)
-        S.commit()
-    reverse_user = { user["name"]: id for id, user in users.items() }
+    reverse_group = {}
+    reverse_user = {}
+    batches = {"group": [], "user": [], "member": []}
+    targets = {"group": Group, "user": User, "member": memberships}
 
-    members = data["members"]
-    for group_name, member_names in members.items():
-        group = S.get(Group, reverse_group[group_name])
+    def flush(*kinds):
+        for kind in kinds:
+            if batches[kind]:
+                S.execute(db.insert(targets[kind]), batches[kind])
+                batches[kind] = []
 
-        group.users = [ S.get(User, reverse_user[name]) for name in member_names ]
+    try:
+        for kind, key, value in _read_records(path):
+            if kind == "group":
+                reverse_group[value] = key
+                batches[kind].append(dict(id=key, name=value))
+            elif kind == "user":
+                reverse_user[value["name"]] = key
+                batches[kind].append(dict(id=key, **value))
+            else:
+                batches[kind].append(
+                    dict(group_id=reverse_group[key], user_id=reverse_user[value])
+                )
+            if len(batches[kind]) >= BATCH_SIZE:
+                # Memberships refer to groups and users: those go in first
+                flush("group", "user", kind)
+        flush("group", "user", "member")
+        refresh_standings()
         S.commit()
+        forget_token()
+        forget_counts()
+        forget_progress()
+        forget_fragments()
+    except Exception:
+        S.rollback()
+        raise
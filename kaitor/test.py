@@ -1,13 +1,27 @@
+import csv
 from datetime import datetime, timedelta
+import io
+import numpy as np
+import zlib
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 import pytest
-from app_factory import create_app
-from models import *
-
-
-def app_in_memory():
-    app = create_app()
+import time
+from . import grades, rebuild, scheduler
+from .blueprints import api
+from .app_factory import create_app
+from .instrumentation import query_budget
+from .deadlines import *
+from .export import *
+from .models import *
+from .rendering import *
+from .search import *
+from .similarity import *
+from .storage import export_members, import_members
+
+
+def app_in_memory(db_uri="sqlite:///:memory:"):
+    app = create_app(db_uri, url_prefix="/")
     app.config.update(
         {
             "TESTING": True,
@@ -60,6 +74,14 @@ def app():
     # clean up / reset resources here
 
 
+@pytest.fixture()
+def site(tmp_path):
+    # The same data in a file, for the command line tools
+    db_uri = f"sqlite:///{tmp_path / 'site.db'}"
+    app_in_memory(db_uri)
+    return db_uri
+
+
 @pytest.fixture()
 def client(app):
     return app.test_client()
@@ -83,6 +105,696 @@ def test_set_membership(app):
         assert u not in g.users
 
 
+def test_keyset_pagination(app):
+    with app.app_context():
+        first = browse_users(limit=2)
+        assert [u.name for u in first] == ["User 1", "User 2"]
+        assert [u.name for u in browse_users(after=first[-1].id, limit=2)] == ["User 3"]
+        assert count_rows(User) == 3
+
+        add_user("User 4")
+        assert count_rows(User) == 4
+        assert [u.name for u in search_members("Group 1", "User", after="User 1")] == ["User 2", "User 3"]
+        assert count_members("Group 1") == 3
+
+
+def test_admin_pagination(app, client):
+    with app.app_context():
+        for i in range(PAGE_SIZE):
+            add_problem(short=f"Extra {i}", text="Extra")
+        last = browse_problems()[-1]
+
+    response = client.get("/88EB109E/")
+    assert f'<option value="{last.id}">{last.short}</option>'.encode() in response.data
+
+    response = client.get("/88EB109E/problems/?q=x")
+    assert f'href="/88EB109E/problems/?q=x&amp;after={PAGE_SIZE}">Next'.encode() in response.data
+
+
+def test_read_user_by_token(app):
+    with app.app_context():
+        u = add_user("User 4")
+        assert read_user_by_token(u.token) is u
+        assert read_user_by_token(u.token) is u
+
+        delete_user(u.id)
+        assert read_user_by_token(u.token) is None
+        assert read_user_by_token("not a token") is None
+
+        # Another worker deletes the user, and SQLite hands the id to the next one
+        u = add_user("User 5")
+        old_id, old_token = u.id, u.token
+        assert read_user_by_token(old_token) is u
+        S.execute(db.delete(User).where(User.id == old_id))
+        S.commit()
+        v = add_user("User 6")
+        assert v.id == old_id
+        assert read_user_by_token(old_token) is None
+        assert read_user_by_token(v.token) is v
+
+
+def test_set_due_solution_bulk(app):
+    with app.app_context():
+        set_membership("User 1", "Group 2")
+        date = datetime.now() + timedelta(days=3)
+        set_due_solution(["Group 1", "Group 2"], ["Prob1", "Prob2"], date)
+        assert S.query(DueSolution).count() == 6
+        assert S.query(DueSolution).filter(DueSolution.date == date).count() == 6
+
+        set_due_solution("Group 2", ["Prob1", "Prob2"], date, set_to=False)
+        assert S.query(DueSolution).filter_by(user_id=read_user("User 1").id).count() == 0
+        assert S.query(DueSolution).count() == 4
+
+
+def test_assign_reviews():
+    pairs = assign_reviews(reviewers=range(10), solvers=range(5), seed=0)
+    assert pairs == assign_reviews(reviewers=range(10), solvers=range(5), seed=0)
+    assert set(pairs) == set(range(10))
+    for user_id, (left, right) in pairs.items():
+        assert left != right and user_id not in (left, right)
+        assert left < 5 and right < 5
+
+    reviews = [s for pair in pairs.values() for s in pair]
+    assert {reviews.count(s) for s in range(5)} == {4}
+
+
+def test_duplicate_clusters(app):
+    with app.app_context():
+        text = "Let x be the smallest counterexample; then x - 1 works, a contradiction."
+        for name, solution_text in [
+            ("Copy 1", text),
+            ("Copy 2", text.upper() + "  "),
+            ("Other", "By induction on n, the base case n = 0 being trivial."),
+        ]:
+            add_user(name)
+            add_solution(name, "Prob1", solution_text)
+
+        clusters = browse_duplicate_clusters("Prob1")
+        assert [{s.user.name for s in cluster} for cluster in clusters] == [{"Copy 1", "Copy 2"}]
+
+        parent = {1: 2, 2: 3, 3: 4, 4: 5}
+        assert find_root(parent, 1) == 5
+        assert all(find_root(parent, x) == 5 for x in range(1, 6))
+
+        signature = minhash(text)
+        shingles = {text.lower()[i:i + SHINGLE] for i in range(len(text) - SHINGLE + 1)}
+        a, b = (int(c) for c in np.random.RandomState(20240330).randint(1, 2**32, size=(2, NUM_PERM))[:, 0])
+        assert signature[0] == min((a * zlib.crc32(sh.encode()) + b) % 4294967311 for sh in shingles)
+
+        pairs = assign_reviews(
+            reviewers=range(6), solvers=range(6), seed=0, clusters=[{0, 1}, {2, 3}],
+        )
+        for left, right in pairs.values():
+            assert {left, right} not in ({0, 1}, {2, 3})
+
+
+def test_open_due_comparisons(app):
+    with app.app_context():
+        for u in ["User 1", "User 2", "User 3"]:
+            add_solution(u, "Prob2", f"Solution of Prob2 by {u}")
+
+        now = datetime.now()
+        assert open_due_comparisons(now=now) == [(1, 1)]
+        assert open_due_comparisons(now=now) == []
+        assert S.query(DueComparison).filter_by(problem_id=2).count() == 0
+
+        later = read_next_deadline(now)
+        assert later > now
+        assert open_due_comparisons(now=later) == []
+        assert open_due_comparisons(now=later + timedelta(seconds=1)) == [(1, 2)]
+        assert S.query(DueComparison).filter_by(problem_id=2).count() == 3
+
+
+def test_scheduler_command(site, capsys):
+    scheduler.main(["--db", site])
+    assert "Opened comparisons of problem 1 for group 1" in capsys.readouterr().out
+    scheduler.main(["--db", site])
+    assert "Opened" not in capsys.readouterr().out
+
+
+def test_scheduler_thread(site):
+    app = create_app(site, scheduler=True)
+    thread = app.extensions["kaitor_scheduler"]
+    try:
+        with app.app_context():
+            watermark = lambda: S.get(Watermark, "deadlines")
+            for _ in range(50):
+                if watermark() is not None:
+                    break
+                S.rollback()
+                time.sleep(0.1)
+            assert watermark() is not None
+    finally:
+        thread.stop()
+        thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+def test_dashboard_query_plans(app):
+    with app.app_context():
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        read_dashboard("User 1")
+        browse_inbound_comparisons("User 1", "Prob1")
+        browse_reviewers("User 1", "Prob1")
+        event.remove(db.engine, "before_cursor_execute", record)
+
+        for statement, parameters in statements:
+            plan = S.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+            for *_, detail in plan:
+                assert not detail.startswith("SCAN"), (statement, detail)
+
+
+def test_migrate(app):
+    with app.app_context():
+        assert read_schema_version() == MIGRATIONS[-1][0]
+        assert migrate() == MIGRATIONS[-1][0]
+        S.execute(db.text("DROP INDEX ix_comparison_problem_worse"))
+        S.execute(db.delete(SchemaVersion).where(SchemaVersion.version >= 2))
+        S.commit()
+        migrate()
+        indexes = db.inspect(db.engine).get_indexes("comparison")
+        assert "ix_comparison_problem_worse" in {index["name"] for index in indexes}
+
+
+def test_migrate_due_comparison_others(app):
+    # A due comparison stored the old way, with its pair in the others column
+    with app.app_context():
+        ids = {u: read_user(f"User {u}").id for u in (1, 2, 3)}
+        pairs = {dc.user_id: dc.pair for dc in S.query(DueComparison)}
+        S.execute(db.text("ALTER TABLE due_comparison ADD COLUMN others VARCHAR"))
+        S.execute(db.delete(DueComparisonTarget).where(DueComparisonTarget.user_id == ids[1]))
+        S.execute(
+            db.text("UPDATE due_comparison SET others = :others WHERE user_id = :user_id"),
+            dict(others=f"{ids[3]};{ids[2]}", user_id=ids[1]),
+        )
+        S.commit()
+        migrate_due_comparison_others()
+        S.expire_all()
+
+        pairs[ids[1]] = (ids[3], ids[2])
+        assert {dc.user_id: dc.pair for dc in S.query(DueComparison)} == pairs
+        assert S.execute(db.text("SELECT count(*) FROM due_comparison WHERE others IS NOT NULL")).scalar() == 0
+
+
+def test_read_review_load(app):
+    with app.app_context():
+        # Three solvers on the ring: every solution gets two reviews
+        load = read_review_load("Prob1")
+        assert load == {read_user(f"User {u}").id: 2 for u in (1, 2, 3)}
+        assert sorted(browse_reviewers("User 1", "Prob1")) == sorted(
+            dc.user_id for dc in S.query(DueComparison) if read_user("User 1").id in dc.pair
+        )
+        assert read_review_load("Prob2") == {}
+
+
+def test_migrate_signs_solutions(app):
+    # Solutions from before signatures existed
+    with app.app_context():
+        S.execute(db.delete(SolutionBand))
+        S.execute(db.delete(SolutionSignature))
+        S.execute(db.delete(SchemaVersion).where(SchemaVersion.version >= 6))
+        S.commit()
+        migrate()
+        assert S.query(SolutionSignature).count() == 3
+        assert S.query(SolutionBand).count() == 3 * BANDS
+
+
+def test_migrate_renames_duplicate_shorts(app, client):
+    with app.app_context():
+        S.execute(db.text("DROP INDEX ix_problem_short"))
+        S.execute(db.insert(Problem).values(short="Prob1", text="Same short"))
+        S.execute(db.delete(SchemaVersion).where(SchemaVersion.version >= 3))
+        S.commit()
+        migrate()
+        shorts = [p.short for p in browse_problems()]
+        assert shorts == ["Prob1", "Prob2", "Prob1 (3)"]
+        assert [r["id"] for r in search("Same short")] == [3]
+
+        with pytest.raises(ValueError):
+            edit_problem(3, "Prob2", "Same short")
+        assert read_problem(3).short == "Prob1 (3)"
+
+    response = client.post("/88EB109E/problems/3/edit/", data={"short": "Prob2", "text": "Same short"})
+    assert response.status_code == 400
+    assert b"Another problem is already called Prob2" in response.data
+    response = client.post("/88EB109E/problems/3/edit/", data={"short": "Prob3", "text": "Same short"})
+    assert response.status_code == 302
+
+
+def test_migrate_indexes_search(app):
+    with app.app_context():
+        S.execute(db.text("DELETE FROM search_index"))
+        S.execute(db.delete(SchemaVersion).where(SchemaVersion.version >= 7))
+        S.commit()
+        assert search("division") == []
+        migrate()
+        assert [r["short"] for r in search("division")] == ["Prob2"]
+        assert len(search("Solution", kind="solution")) == 3
+
+
+def test_migrate_drops_duplicates(app):
+    with app.app_context():
+        # A legacy database: no unique indexes, and a compare that raced itself
+        S.execute(db.text("DROP INDEX ix_comparison_user_problem"))
+        S.execute(db.text("DROP INDEX ix_solution_user_problem"))
+        old_id = S.query(Comparison).filter_by(user_id=1, problem_id=1).one().id
+        S.execute(db.insert(Comparison), [dict(user_id=1, problem_id=1, better=3, worse=2, motivation="Again")])
+        S.execute(db.insert(Solution), [dict(user_id=1, problem_id=1, solution_text="Again")])
+        S.execute(db.delete(SchemaVersion).where(SchemaVersion.version >= 2))
+        S.commit()
+        migrate()
+        (c,) = S.query(Comparison).filter_by(user_id=1, problem_id=1).all()
+        assert c.id > old_id and c.motivation == "Again"
+        (s,) = S.query(Solution).filter_by(user_id=1, problem_id=1).all()
+        assert s.solution_text == "Again"
+
+
+def test_migrate_user_token_index(app):
+    with app.app_context():
+        S.execute(db.text("DROP INDEX ix_user_token"))
+        S.execute(db.update(User).where(User.id == 2).values(token=read_user(1).token))
+        S.execute(db.delete(SchemaVersion).where(SchemaVersion.version >= 5))
+        S.commit()
+        migrate()
+        assert read_user(1).token != read_user(2).token
+        plan = S.execute(db.text("EXPLAIN QUERY PLAN SELECT id FROM user WHERE token = 'X'")).all()
+        assert "ix_user_token" in " ".join(row[-1] for row in plan)
+
+
+def test_read_page_version(app):
+    with app.app_context():
+        u1, u2 = read_user("User 1"), read_user("User 2")
+        dashboard, page, other = read_page_version(u1), read_page_version(u1, 2), read_page_version(u2, 2)
+
+        add_solution(u1, "Prob2", "Solution of Prob2 by User 1")
+        assert read_page_version(u1) != dashboard
+        assert read_page_version(u1, 2) != page
+        assert read_page_version(u2, 2) == other
+
+        page = read_page_version(u1, 2)
+        assert read_page_version(u1, 2, now=datetime.now() + timedelta(days=2)) != page
+
+        edit_problem(2, "Prob2", "A new text")
+        assert read_page_version(u1, 2) != page
+
+
+def test_set_password_changes_etag(app, client):
+    with app.app_context():
+        u1 = read_user("User 1")
+        token, name = u1.token, u1.name
+
+    response = client.get(f"/u/{token}/")
+    etag = response.headers["ETag"]
+    assert b'<h5 class="my-1">Attenzione</h5>' in response.data
+    assert client.get(f"/u/{token}/", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post(f"/u/{token}/set_password/", json={"username": name, "new_password": "pass"})
+    response = client.get(f"/u/{token}/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert b'<h5 class="my-1">Attenzione</h5>' not in response.data
+
+
+def test_api(app, client):
+    with app.app_context():
+        token = read_user("User 1").token
+        group_id = read_group("Group 1").id
+    base = f"/api/v1/u/{token}/problems/"
+
+    response = client.get(base)
+    problems = response.get_json()["problems"]
+    assert [set(p) for p in problems] == [set(api.PROBLEM_LIST_FIELDS)] * 2
+    assert [(p["short"], p["state"]) for p in problems] == [("Prob1", "past"), ("Prob2", "unsolved")]
+
+    response = client.get(base + "?fields=short,wins")
+    assert response.get_json()["problems"][0] == {"short": "Prob1", "wins": 0}
+    response = client.get(base + "?fields=short,password")
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Unknown fields: password"
+
+    assert client.get("/api/v1/u/not-a-token/problems/").status_code == 401
+    assert client.get(base + "99/").status_code == 404
+    assert client.get(base + "1/?fields=short,solution_text").get_json()["problem"]["short"] == "Prob1"
+    assert client.get("/api/v1/g/99/members/").status_code == 404
+    assert client.get("/api/v1/g/99/leaderboard/").status_code == 404
+
+    members = client.get(f"/api/v1/g/{group_id}/members/?fields=name,solutions").get_json()
+    assert members == {"members": [
+        {"name": f"User {u}", "solutions": 1} for u in (1, 2, 3)
+    ], "next": None}
+    standings = client.get(f"/api/v1/g/{group_id}/leaderboard/?fields=name,wins").get_json()["standings"]
+    assert standings[0] == {"name": "User 2", "wins": 2}
+
+    # The ETag follows the data and the field selection
+    etag = client.get(base).headers["ETag"]
+    assert client.get(base, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(base + "?fields=id", headers={"If-None-Match": etag}).status_code == 200
+    with app.app_context():
+        add_solution("User 1", "Prob2", "Solution of Prob2 by User 1")
+    response = client.get(base, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json()["problems"][1]["state"] == "solved"
+
+
+def test_fragment_cache(app, monkeypatch):
+    with app.app_context():
+        forget_fragments()
+        hits, misses = fragment_stats["hits"], fragment_stats["misses"]
+        render = lambda: ", ".join(g.name for g in browse_groups())
+
+        assert cached_fragment("groups", None, render) == "Group 1, Group 2"
+        assert cached_fragment("groups", None, render) == "Group 1, Group 2"
+        assert (fragment_stats["hits"] - hits, fragment_stats["misses"] - misses) == (1, 1)
+
+        add_group("Group 3")
+        assert cached_fragment("groups", None, render) == "Group 1, Group 2, Group 3"
+
+        cached_fragment("members", 1, lambda: "before")
+        cached_fragment("members", 2, lambda: "before")
+        set_membership("User 1", "Group 2")
+        assert cached_fragment("members", 1, lambda: "after") == "before"
+        assert cached_fragment("members", 2, lambda: "after") == "after"
+
+        # Another worker wrote the group: this one catches up once the entry expires
+        S.execute(db.insert(Group).values(name="Group 4"))
+        S.commit()
+        assert cached_fragment("groups", None, render) == "Group 1, Group 2, Group 3"
+        later = time.monotonic() + FRAGMENT_TTL + 1
+        monkeypatch.setattr(time, "monotonic", lambda: later)
+        assert cached_fragment("groups", None, render) == "Group 1, Group 2, Group 3, Group 4"
+
+
+def test_query_budget(app, client):
+    with app.app_context():
+        with query_budget(3):
+            read_dashboard("User 1")
+        with pytest.raises(AssertionError):
+            with query_budget(2):
+                for u in ["User 1", "User 2", "User 3"]:
+                    S.query(Solution).filter_by(user_id=read_user(u).id).first()
+
+    with app.app_context():
+        token = read_user("User 1").token
+    with query_budget(2):
+        response = client.get("/")
+    assert response.status_code == 200
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+    with query_budget(4):
+        response = client.get(f"/u/{token}/")
+    assert response.status_code == 200
+    with query_budget(10):
+        response = client.get(f"/u/{token}/p/1/")
+    assert response.status_code == 200
+
+
+def test_browse_due_problems(app):
+    with app.app_context():
+        rows = browse_due_problems("User 1", ["short", "state", "comparison_state"])
+        assert [tuple(row) for row in rows] == [("Prob1", "past", "done"), ("Prob2", "unsolved", None)]
+
+        (row,) = browse_due_problems("User 1", ["left", "right", "wins", "losses"], problem=1)
+        assert sorted(row[:2]) == [2, 3] and row[2:] == (0, 2)
+
+        rows = browse_roster("Group 1", ["name", "solutions"], limit=2)
+        assert [tuple(row) for row in rows] == [("User 1", 1, "User 1"), ("User 2", 1, "User 2")]
+        rows = browse_roster("Group 1", ["id"], after=rows[-1][-1])
+        assert [row[0] for row in rows] == [3]
+
+
+def test_readers_not_blocked_by_writer(tmp_path):
+    import threading, time
+    app = create_app(f"sqlite:///{tmp_path / 'site.db'}")
+    with app.app_context():
+        add_group("Group 1")
+        assert S.execute(db.text("PRAGMA journal_mode")).scalar() == "wal"
+
+        # An exclusive lock, as a writer takes to commit, locks readers out of a journal database
+        writer = db.engine.connect()
+        writer.exec_driver_sql("BEGIN EXCLUSIVE")
+        writer.execute(db.insert(Group).values(name="Group 2"))
+
+        seen = []
+        def read():
+            with app.app_context():
+                start = time.perf_counter()
+                seen.append([g.name for g in browse_groups()])
+                seen.append(time.perf_counter() - start)
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join(timeout=2)
+        writer.commit()
+        writer.close()
+
+        assert seen[0] == ["Group 1"] and seen[1] < 1
+
+
+def test_add_helpers_upsert(app):
+    with app.app_context():
+        groups = add_group(["Group 2", "Group 3"])
+        assert [g.name for g in groups] == ["Group 2", "Group 3"]
+        assert groups[0].id == 2 and count_rows(Group) == 3
+
+        token = read_user("User 3").token
+        u3, u4 = add_user(["User 3", "User 4"], password="secret")
+        assert u3.token == token and u3.password == "pass3" and u4.password == "secret"
+
+        assert add_problem("Prob1", "Another text").text.startswith("# Some problem about sum")
+
+        with pytest.raises(IndexError):
+            add_solution("User 1", "Prob1", "Again")
+        add_solution(["User 1", "User 4"], "Prob2", ["First", "Second"])
+        s = add_solution("User 1", "Prob2", "Replaced", replace=True)
+        assert s.solution_text == "Replaced" and S.query(Solution).filter_by(problem_id=2).count() == 2
+
+        c = add_comparison("User 1", "Prob1", "User 3", "User 2", "Changed my mind")
+        assert (c.better, c.worse) == (3, 2)
+        assert S.query(Comparison).filter_by(user_id=1, problem_id=1).count() == 1
+
+
+def test_unit_of_work(app):
+    with app.app_context():
+        commits = []
+        def record(conn):
+            commits.append(conn)
+        event.listen(db.engine, "commit", record)
+
+        with unit_of_work():
+            add_group("Group 3")
+            for u in ["User 1", "User 2", "User 3"]:
+                set_membership(u, "Group 3")
+            set_due_solution("Group 3", "Prob1", datetime.now() - timedelta(days=1))
+            set_due_comparison("Group 3", "Prob1")
+        assert len(commits) == 1
+
+        with pytest.raises(RuntimeError):
+            with unit_of_work():
+                add_group("Group 4")
+                set_due_solution("Group 4", "Prob2", datetime.now())
+                raise RuntimeError
+        event.remove(db.engine, "commit", record)
+        assert len(commits) == 1
+        assert read_group("Group 4") is None
+
+
+def test_leaderboard(app):
+    with app.app_context():
+        rows = browse_leaderboard("Group 1", read_problem("Prob1").id)
+        assert [(r.name, r.wins, r.losses, r.reviews_done) for r in rows] == [
+            ("User 2", 2, 0, 1), ("User 3", 1, 1, 1), ("User 1", 0, 2, 1),
+        ]
+
+        add_solution("User 1", "Prob2", "Solution by User 1.")
+        add_comparison("User 1", "Prob1", "User 3", "User 2", "Changed my mind")
+        rows = {r.name: r for r in browse_leaderboard("Group 1")}
+        assert rows["User 1"].submissions == 2 and rows["User 2"].submissions == 1
+        assert (rows["User 2"].wins, rows["User 2"].losses) == (1, 1)
+        assert (rows["User 3"].wins, rows["User 3"].losses) == (2, 0)
+
+        before = [tuple(r) for r in browse_leaderboard("Group 1")]
+        rebuild_standings()
+        assert [tuple(r) for r in browse_leaderboard("Group 1")] == before
+
+        set_membership("User 3", "Group 1", False)
+        assert [r.name for r in browse_leaderboard("Group 1")] == ["User 2", "User 1"]
+
+
+def test_read_progress(app):
+    with app.app_context():
+        group_id = read_group("Group 1").id
+        with query_budget(3):
+            progress = read_progress(group_id)
+        assert [p.short for p in progress["problems"]] == ["Prob1", "Prob2"]
+        assert [cells for _, cells in progress["rows"]] == [["reviewed", None]] * 3
+        with query_budget(0):
+            assert read_progress(group_id) is progress
+
+        add_solution("User 1", "Prob2", "Solution by User 1.")
+        set_due_solution("Group 1", "Prob2", datetime.now() - timedelta(hours=1))
+        cells = {user.name: cells for user, cells in read_progress(group_id)["rows"]}
+        assert cells["User 1"] == ["reviewed", "submitted"]
+        assert cells["User 2"] == ["reviewed", "late"]
+        assert read_progress()["totals"][read_problem("Prob2").id] == dict(
+            submitted=1, late=2, pending=0, reviewed=0,
+        )
+
+
+def test_export_grades(app):
+    with app.app_context():
+        group_id = read_group("Group 1").id
+        rows = list(csv.reader(io.StringIO("".join(export_grades(group_id)))))
+    assert rows[0][:7] == ["id", "name", "points", "Prob1 state", "Prob1 wins", "Prob1 losses", "Prob1 points"]
+    assert rows[0][7:] == ["Prob2 state", "Prob2 wins", "Prob2 losses", "Prob2 points"]
+    grades = {row[1]: row[3:] for row in rows[1:]}
+    assert grades["User 2"][:3] == ["reviewed", "2", "0"]
+    assert grades["User 1"][:3] == ["reviewed", "0", "2"]
+    assert grades["User 1"][4:] == ["open", "0", "0", ""]
+    assert int(grades["User 2"][3]) > int(grades["User 1"][3])
+
+
+@pytest.mark.parametrize("suffix", [".yaml", ".jsonl"])
+def test_export_import_members(app, tmp_path, suffix):
+    def roster():
+        return (
+            sorted(g.name for g in browse_groups()),
+            sorted((u.name, u.token) for u in browse_users()),
+            sorted((g.name, u.name) for g in browse_groups() for u in g.users),
+        )
+
+    path = tmp_path / f"roster{suffix}"
+    with app.app_context():
+        set_membership(add_user("Niccolò"), add_group("Classe 3ª"))
+        export_members(path)
+        expected = roster()
+    assert ("Group 2" in expected[0]) and ("Classe 3ª", "Niccolò") in expected[2]
+
+    copy = create_app()
+    with copy.app_context():
+        import_members(path)
+        assert roster() == expected
+
+    empty = create_app()
+    with empty.app_context():
+        export_members(path)
+        import_members(path)
+        assert roster() == ([], [], [])
+
+
+def test_grades_command(site, tmp_path, capsys):
+    grades.main(["--db", site, "--group", "Group 1", "--output", str(tmp_path / "grades.csv")])
+    with open(tmp_path / "grades.csv", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0][:4] == ["id", "name", "points", "Prob1 state"]
+    assert sorted(row[1] for row in rows[1:]) == ["User 1", "User 2", "User 3"]
+
+    grades.main(["--db", site])
+    assert list(csv.reader(io.StringIO(capsys.readouterr().out))) == rows
+
+
+def test_rebuild_command(site, capsys):
+    app = create_app(site)
+    with app.app_context():
+        standings = lambda: [(r.name, r.wins, r.losses, r.reviews_done) for r in browse_leaderboard("Group 1")]
+        before = standings()
+        for table in ["standing", "search_index", "solution_signature", "solution_band"]:
+            S.execute(db.text(f"DELETE FROM {table}"))
+        S.execute(db.update(User).values(points=0))
+        S.commit()
+
+    rebuild.main(["--db", site, "standings", "search", "signatures", "points"])
+    assert capsys.readouterr().out.splitlines() == [
+        "Rebuilt standings", "Rebuilt search", "Rebuilt signatures", "Rebuilt points",
+    ]
+    with app.app_context():
+        assert standings() == before
+        assert [r["short"] for r in search("division")] == ["Prob2"]
+        assert S.query(SolutionSignature).count() == 3
+        assert read_user("User 2").points > read_user("User 1").points
+
+
+def test_render_markdown():
+    html = render_markdown("# Title\n\n<b>raw</b> and $x^2$ and $$\\frac{1}{2}$$")
+    assert "<h1>Title</h1>" in html and "&lt;b&gt;raw&lt;/b&gt;" in html
+    assert "<msup><mi>x</mi><mn>2</mn></msup>" in html and 'display="block"' in html
+
+    html = render_markdown("$\\text{<img/src=x/onerror=alert(1)>}$")
+    assert "<img" not in html and "&lt;img/src=x/onerror=alert(1)&gt;" in html
+    html = render_markdown("[x](javascript:alert(1)) [y](https://example.com) $\\href{javascript:alert(1)}{z}$")
+    assert "javascript" not in html and 'href="https://example.com"' in html
+
+    html = render_markdown("KAITORMATH7X and $y$")
+    assert "KAITORMATH7X" in html and "<mi>y</mi>" in html
+
+
+def test_refit_points(app):
+    with app.app_context():
+        overall, per_problem = refit_points()
+        u1, u2, u3 = (read_user(f"User {i}") for i in (1, 2, 3))
+        assert u2.points > u3.points > u1.points
+        assert overall == per_problem[read_problem("Prob1").id]
+        assert fit_problem_points([read_problem("Prob1").id]) == per_problem
+        assert fit_problem_points([read_problem("Prob2").id]) == {}
+
+
+def test_apply_verdict(app):
+    with app.app_context():
+        points = lambda: {u.name: u.points for u in browse_users()}
+        expected = points()
+
+        def step(better, worse):
+            e = 1 / (1 + 10 ** ((expected[worse] - expected[better]) / 400))
+            expected[better] = round(expected[better] + ELO_K * (1 - e))
+            expected[worse] = round(expected[worse] - ELO_K * (1 - e))
+
+        # User 1 said 2 > 3: the new verdict undoes that step before its own
+        add_comparison("User 1", "Prob1", "User 3", "User 2", "Changed my mind")
+        step("User 3", "User 2")
+        step("User 3", "User 2")
+        assert points() == expected
+
+        add_comparison("User 1", "Prob1", "User 3", "User 2", "Same verdict")
+        assert points() == expected
+
+
+def test_refresh_points(app):
+    with app.app_context():
+        now = datetime.now()
+        assert refresh_points(now) is True
+        overall, _ = fit_rankings()
+        assert {u.id: u.points for u in browse_users()} == overall
+        assert refresh_points(now + timedelta(minutes=1)) is False
+        assert refresh_points(now + REFIT_INTERVAL + timedelta(seconds=1)) is True
+
+
+def test_search(app):
+    with app.app_context():
+        assert [r["short"] for r in search("division")] == ["Prob2"]
+        assert {r["kind"] for r in search("solution User")} == {"solution"}
+        assert len(search("solution", kind="solution", limit=2)) == 2
+
+        p = read_problem("Prob2")
+        edit_problem(p.id, p.short, "# Some problem about products")
+        assert search("division") == []
+        assert [r["id"] for r in search("product")] == [p.id]
+
+
+def test_read_dashboard(app):
+    with app.app_context():
+        past, solved, unsolved = read_dashboard("User 1")
+        assert [p["short"] for p in past] == ["Prob1"]
+        assert past[0]["comparison"] is not None
+        assert solved == []
+        assert [p["short"] for p in unsolved] == ["Prob2"]
+
+        add_solution("User 1", "Prob2", "Solution by User 1.")
+        past, solved, unsolved = read_dashboard("User 1")
+        assert [p["short"] for p in solved] == ["Prob2"]
+        assert unsolved == []
+
+
 def test_request_example(app, client):
     response = client.get("/")
     assert b"Quale classe?" in response.data